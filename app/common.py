@@ -1,7 +1,32 @@
 # -*- coding: utf-8 -*-
+import importlib
 
 # ==========================================================
 # SYMBOLIC CONSTANTS
 # ==========================================================
 # run environment (prd or dev)
 ENV = "dev"
+
+
+# ==========================================================
+# GLOBAL VARIABLES
+# ==========================================================
+# optional modules imported so far: name -> module, or None if not installed
+optional_modules = {}
+
+
+# ==========================================================
+# FUNCTIONS
+# ==========================================================
+def optional_import(name) -> object:
+    """
+    Import an optional module on first use, since heavy modules slow down
+    startup. Returns None if it is not installed.
+    """
+    if name not in optional_modules:
+        try:
+            optional_modules[name] = importlib.import_module(name)
+        except ImportError:
+            optional_modules[name] = None
+
+    return optional_modules[name]
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import logging
+from queue import Queue
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+
+from app.common import ENV
+from app.pixlog import PixTrace, emit_lines
+from app.pixwork import PixWorkerGroup
+from app.pixmove import PixMovePlanner
+from app.pixplan import PixPlan
+from app.pixjournal import PixJournal
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixAsyncWorkerGroup(PixWorkerGroup):
+    """
+    Renaming works driven by an asyncio event loop. Renames are blocking
+    system calls, so they are offloaded to a thread pool while the loop keeps
+    up to a given number of them in flight. It pays off on network file
+    systems, where every rename is a round-trip to the server.
+    """
+    concurrency_max = 1024
+
+    def __init__(self, concurrency=64, bash_history=False, save_plan=None):
+        """
+        Initialization
+        """
+        # the event loop is the only worker
+        super().__init__(1, bash_history, save_plan)
+
+        if concurrency <= 0:
+            self.concurrency = 1
+        elif concurrency <= self.concurrency_max:
+            self.concurrency = concurrency
+        else:
+            logger.warning(f"Too many renames in flight: {concurrency} (use {self.concurrency_max})")
+            self.concurrency = self.concurrency_max
+
+    def start(self, uppercase, apply=False, shards=None):
+        """
+        Start renaming works on an event loop and wait for them to finish.
+        Shards of a saved plan can be given instead of added works.
+        """
+        self.__prepare(uppercase, apply)
+
+        if shards is None:
+            shards = self.shards(self.uppercase)
+
+        asyncio.run(self.__run(self.__listed(shards), apply))
+
+        self.report()
+
+    def start_streaming(self, uppercase, apply=False):
+        """
+        Start renaming works in streaming mode. The event loop runs on its own
+        thread and takes directory shards handed over by flush().
+        """
+        self.__prepare(uppercase, apply)
+
+        self.stream = Queue(maxsize=self.stream_depth)
+
+        worker = Thread(target=asyncio.run, args=(self.__run(self.__streamed(self.stream), apply),))
+        self.threads.append(worker)
+
+        worker.start()
+
+    def __prepare(self, uppercase, apply):
+        """
+        Set operation mode
+        """
+        self.uppercase = uppercase
+
+        mode = "apply mode with history logging" if apply else "preview mode"
+        logger.info(f"Start event loop with up to {self.concurrency} rename(s) in flight in {mode}")
+
+        if apply:
+            self.history = PixJournal(".", bash=self.bash_history)
+        elif self.save_plan:
+            self.history = PixPlan(self.save_plan, uppercase=uppercase)
+
+    async def __run(self, shards, apply):
+        """
+        Do (or preview) renaming works. Renames of a directory are planned on
+        the thread pool, and then their independent sequences run
+        concurrently. Sequence numbers are assigned beforehand, as the thread
+        workers do.
+        """
+        loop = asyncio.get_running_loop()
+        stats = self.stats[0]
+
+        slots = asyncio.Semaphore(self.concurrency)
+        running = set()
+
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="pixrename") as pool:
+            async for base, moves in shards:
+                try:
+                    stats.shards += 1
+                    stats.files += len(moves)
+
+                    sequences, blocked = await loop.run_in_executor(
+                        pool, self.__plan, base, [(x, y) for x, y in moves if x != y], apply)
+
+                    stats.blocked += len(blocked)
+
+                    if not apply:
+                        emit_lines(PixWorkerGroup.preview_lines(base, moves, blocked, stats))
+                        continue
+
+                    for x, y in moves:
+                        if x == y:
+                            stats.unchanged += 1
+
+                            if PixTrace.sample():
+                                logger.info(" [X] %-30s <-- %s (@%s)", "---", x, base)
+
+                    for x, y in blocked:
+                        logger.error(" [!] %s <-- %s (@%s): target is taken, not renamed", y, x, base)
+
+                    for sequence in sequences:
+                        # wait for a free slot, which holds back planning
+                        await slots.acquire()
+
+                        task = loop.create_task(self.__execute(pool, base, sequence, slots))
+                        running.add(task)
+                        task.add_done_callback(running.discard)
+
+                except Exception:
+                    logger.exception(f"Renaming works failed in a directory: {base}")
+
+            if running:
+                await asyncio.gather(*running)
+
+        stats.elapsed += time.perf_counter() - started
+
+    def __plan(self, base, moves, apply):
+        """
+        Plan renames of a directory, and write them ahead of renaming (or
+        save them in preview mode)
+        """
+        sequences, blocked = PixMovePlanner.plan(base, moves)
+
+        if apply:
+            self.history.write(base, sequences)
+        elif self.history is not None:
+            self.history.write(base, moves)
+
+        return sequences, blocked
+
+    async def __execute(self, pool, base, sequence, slots):
+        """
+        Rename files of a sequence on the thread pool
+        """
+        try:
+            # add after the await, as other tasks update the count meanwhile
+            renamed = await asyncio.get_running_loop().run_in_executor(
+                pool, PixMovePlanner.execute, base, sequence, self.history)
+
+            self.stats[0].renamed += renamed
+
+        except Exception:
+            logger.exception(f"Renaming works failed in a directory: {base}")
+
+        finally:
+            slots.release()
+
+    @staticmethod
+    async def __listed(shards):
+        """
+        Iterate over a list of shards
+        """
+        for shard in shards:
+            yield shard
+
+    @staticmethod
+    async def __streamed(stream):
+        """
+        Iterate over shards handed over through a stream, until None. Waiting
+        is done on a separate thread, so renames in flight keep going.
+        """
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(1, thread_name_prefix="pixstream") as feeder:
+            while True:
+                shard = await loop.run_in_executor(feeder, stream.get)
+
+                if shard is None:
+                    break
+
+                yield shard
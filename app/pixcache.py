@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import sqlite3
+import logging
+
+from app.common import ENV
+from app.pixstamp import PixStamp
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# default cache file name (created in the input directory)
+CACHE_FILE = ".pixcache.db"
+
+# rules which take stamps from file names: their stamps are only valid under the same name
+NAME_RULES = ("R1",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stamps (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    fmt TEXT NOT NULL,
+    stamp TEXT NOT NULL,
+    desc TEXT NOT NULL,
+    run INTEGER NOT NULL,
+    PRIMARY KEY (dev, ino)
+);
+"""
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixCache:
+    """
+    Persistent inspection cache. Stamps are stored per file identity
+    (device, inode) and are valid while size and mtime are unchanged, so
+    they survive renames. Stamps taken from file names are only valid under
+    the same name.
+    """
+    # number of pending writes before a commit
+    commit_interval = 1000
+
+    def __init__(self, cache_path):
+        """
+        Initialization
+        """
+        self.path = os.path.abspath(cache_path)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+        # every run has its own id, used to find entries not seen in this run
+        self.run = self.db.execute(
+            "INSERT INTO runs (started) VALUES (?)", (time.time(),)).lastrowid
+        self.db.commit()
+
+        self.seen = []
+        self.pending = 0
+
+        logger.info(f"Use inspection cache at {self.path}")
+
+    def get(self, pix_path, st) -> object:
+        """
+        Return a cached pixstamp of a given file, or None if not cached or
+        the file has changed since
+        """
+        row = self.db.execute(
+            "SELECT size, mtime, name, fmt, stamp, desc FROM stamps WHERE dev=? AND ino=?",
+            (st.st_dev, st.st_ino)).fetchone()
+
+        if row is not None:
+            size, mtime, name, fmt, stamp, desc = row
+
+            if size == st.st_size and mtime == st.st_mtime_ns \
+                    and (desc not in NAME_RULES or name == os.path.basename(pix_path)):
+                self.hits += 1
+
+                # the file may have been renamed since
+                self.seen.append((self.run, os.path.basename(pix_path), os.path.abspath(pix_path),
+                                  st.st_dev, st.st_ino))
+
+                if self.commit_interval <= len(self.seen):
+                    self.__flush_seen()
+
+                return PixStamp(fmt, stamp, desc)
+
+        self.misses += 1
+        return None
+
+    def put(self, pix_path, st, stamp):
+        """
+        Store a pixstamp of a given file
+        """
+        self.db.execute(
+            "INSERT OR REPLACE INTO stamps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+             os.path.basename(pix_path), os.path.abspath(pix_path),
+             stamp.fmt, stamp.stamp, stamp.desc, self.run))
+
+        self.pending += 1
+
+        if self.commit_interval <= self.pending:
+            self.db.commit()
+            self.pending = 0
+
+    def evict(self, kept_dirs=()):
+        """
+        Remove entries of vanished files. Only entries not seen in this run
+        are checked against the file system, except ones in given directories
+        (absolute paths) which are known to be unchanged and not looked up.
+        """
+        self.__flush_seen()
+
+        rows = self.db.execute(
+            "SELECT dev, ino, path FROM stamps WHERE run < ?", (self.run,)).fetchall()
+
+        vanished = []
+
+        for dev, ino, path in rows:
+            if os.path.dirname(path) in kept_dirs:
+                continue
+
+            try:
+                st = os.stat(path)
+                if (st.st_dev, st.st_ino) == (dev, ino):
+                    continue
+            except OSError:
+                pass
+
+            vanished.append((dev, ino))
+
+        self.db.executemany("DELETE FROM stamps WHERE dev=? AND ino=?", vanished)
+        self.db.commit()
+
+        self.evicted += len(vanished)
+
+    def report(self):
+        """
+        Log cache statistics
+        """
+        logger.info(f"Inspection cache: {self.hits} hit(s), {self.misses} miss(es), "
+                    f"{self.evicted} evicted")
+
+    def close(self):
+        """
+        Write pending changes and close the cache
+        """
+        if self.db:
+            self.__flush_seen()
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def __flush_seen(self):
+        """
+        Mark entries hit in this run, with their current names
+        """
+        if self.seen:
+            self.db.executemany("UPDATE stamps SET run=?, name=?, path=? WHERE dev=? AND ino=?", self.seen)
+            self.db.commit()
+            self.seen = []
+            self.pending = 0
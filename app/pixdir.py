@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import logging
+from threading import Lock
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from app.common import ENV
+from app.pixmetrics import PixMetrics
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# maximum number of directory handles kept open
+DIR_FD_MAX = 64
+
+# directory-relative file operations are not available on every platform
+DIR_FD_SUPPORTED = {os.open, os.stat, os.rename} <= os.supports_dir_fd and os.listdir in os.supports_fd
+
+O_DIRECTORY = getattr(os, "O_DIRECTORY", 0)
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixDirHandles:
+    """
+    Open directory handles (file descriptors), shared by threads. Files are
+    stat'ed, opened and renamed relative to the handle of their directory,
+    so their paths are not resolved component by component again, and
+    renames are not affected by renames of parent directories. The least
+    recently used handles are closed beyond a cap, unless in use.
+    """
+    def __init__(self, capacity=DIR_FD_MAX):
+        """
+        Initialization
+        """
+        self.capacity = capacity
+
+        # directory path -> [file descriptor, number of users], in LRU order
+        self.handles = OrderedDict()
+        self.lock = Lock()
+
+        # numbers of handles opened, reused and evicted
+        self.num_opened = 0
+        self.num_reused = 0
+        self.num_evicted = 0
+
+    def acquire(self, dir_path) -> int:
+        """
+        Return a file descriptor of a directory, or None if it cannot be
+        opened (or is not supported). Release it after use.
+        """
+        if not DIR_FD_SUPPORTED:
+            return None
+
+        with self.lock:
+            handle = self.handles.get(dir_path)
+
+            if handle is not None:
+                return self.__use(dir_path, handle)
+
+        started = time.perf_counter()
+
+        # opened without the lock, since it may block on network mounts
+        try:
+            fd = os.open(dir_path or os.curdir, os.O_RDONLY | O_DIRECTORY)
+        except OSError as e:
+            logger.debug(f"Cannot open directory: {dir_path} ({e.strerror})")
+            return None
+
+        if PixMetrics.enabled:
+            PixMetrics.record("opendir", started)
+
+        with self.lock:
+            handle = self.handles.get(dir_path)
+
+            # opened by another thread meanwhile
+            if handle is not None:
+                os.close(fd)
+                return self.__use(dir_path, handle)
+
+            self.handles[dir_path] = [fd, 1]
+            self.num_opened += 1
+            self.__evict()
+
+        return fd
+
+    def release(self, dir_path):
+        """
+        Release a directory handle acquired
+        """
+        with self.lock:
+            self.handles[dir_path][1] -= 1
+            self.__evict()
+
+    @contextmanager
+    def opened(self, dir_path):
+        """
+        Hold a directory handle (or None) while in the context
+        """
+        dir_fd = self.acquire(dir_path)
+
+        try:
+            yield dir_fd
+        finally:
+            if dir_fd is not None:
+                self.release(dir_path)
+
+    def relative(self, paths):
+        """
+        Iterate over file paths as (path, directory handle or None, file name).
+        The handle of a directory is held while its files come in a row.
+        """
+        dir_path = None
+        dir_fd = None
+
+        try:
+            for x in paths:
+                base, name = os.path.split(x)
+
+                if base != dir_path:
+                    if dir_fd is not None:
+                        self.release(dir_path)
+
+                    dir_path, dir_fd = base, self.acquire(base)
+
+                yield x, dir_fd, name
+
+        finally:
+            if dir_fd is not None:
+                self.release(dir_path)
+
+    def close(self):
+        """
+        Close directory handles not in use
+        """
+        with self.lock:
+            for dir_path, (fd, users) in list(self.handles.items()):
+                if users == 0:
+                    os.close(fd)
+                    del self.handles[dir_path]
+
+    def report(self):
+        """
+        Log usage of directory handles
+        """
+        if self.num_opened:
+            logger.info(f"Directory handles: {self.num_opened} opened, {self.num_reused} reused, "
+                        f"{self.num_evicted} evicted (up to {self.capacity} kept open)")
+
+    def __use(self, dir_path, handle) -> int:
+        """
+        Take a handle open (under the lock)
+        """
+        handle[1] += 1
+        self.handles.move_to_end(dir_path)
+        self.num_reused += 1
+
+        return handle[0]
+
+    def __evict(self):
+        """
+        Close the least recently used handles not in use, beyond the cap
+        (under the lock)
+        """
+        excess = len(self.handles) - self.capacity
+
+        if excess <= 0:
+            return
+
+        for dir_path, (fd, users) in list(self.handles.items()):
+            if users == 0:
+                os.close(fd)
+                del self.handles[dir_path]
+                self.num_evicted += 1
+                excess -= 1
+
+                if excess == 0:
+                    break
+
+
+# Directory handles shared by inspection and renaming
+DIR_HANDLES = PixDirHandles()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import mmap
+import time
+import logging
+
+from app.common import ENV
+from app.pixmetrics import PixMetrics
+from app.pixtype import SNIFF_SIZE, PX_TYPE, PixTypeMapper
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixFile:
+    """
+    Pix file opened for inspection. The file is opened once and its header
+    is read by a single bounded read, which is then shared by type sniffing
+    and metadata extraction. Given a handle of its directory, it is opened
+    by name relative to the handle. Use it as a context manager.
+    """
+    # size of the read buffer, which also bounds the shared header
+    header_size = 8 * 1024
+
+    def __init__(self, pix_path, dir_fd=None):
+        """
+        Initialization
+        """
+        self.path = pix_path
+        self.dir_fd = dir_fd
+        self.file = None
+        self.map = None
+        self.stat = None
+        self.header = b""
+        self.type = PX_TYPE.UNKNOWN
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        """
+        Open the file, take its stat and map it to media type object
+        """
+        metered = PixMetrics.enabled
+        started = time.perf_counter()
+
+        if self.dir_fd is not None:
+            self.file = open(os.path.basename(self.path), "rb", buffering=self.header_size,
+                             opener=lambda name, flags: os.open(name, flags, dir_fd=self.dir_fd))
+        else:
+            self.file = open(self.path, "rb", buffering=self.header_size)
+        self.stat = os.fstat(self.file.fileno())
+
+        # fill the read buffer without moving the file position, so later
+        # reads from the beginning are served from the same buffer
+        self.header = self.file.peek(self.header_size)[:self.header_size]
+
+        if metered:
+            PixMetrics.record("open", started, nbytes=len(self.header))
+            started = time.perf_counter()
+
+        self.type = PixTypeMapper.sniff(self.header[:SNIFF_SIZE], self.path)
+
+        if self.type is None:
+            self.type = PixTypeMapper.guess(self.path)
+
+        if metered:
+            PixMetrics.record("type", started)
+
+    def close(self):
+        """
+        Close the file
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def rewind(self):
+        """
+        Return a file object positioned at the beginning of the file
+        """
+        self.file.seek(0)
+        return self.file
+
+    def mmap(self):
+        """
+        Return a read-only memory map of the file, or None if it cannot be
+        mapped (e.g. empty files). Pages are only read when accessed.
+        """
+        if self.map is None and 0 < self.stat.st_size:
+            try:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                logger.error(f"Cannot map file: {self.path} ({e})")
+
+        return self.map
@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
-import glob
 import os
+import time
+import heapq
+import logging
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app.common import ENV
+from app.pixmetrics import PixMetrics
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
 
 
 # ==========================================================
@@ -11,55 +23,206 @@ class PixFinder:
     """
     Find pix files in a given directory recursively.
     """
-    def __init__(self):
+    # number of slowest directories to report
+    slow_dirs_max = 10
+
+    def __init__(self, hidden=False, num_workers=1, ordered=True, manifest=None):
         """
         Initialization
         """
-        self.files = None
+        self.hidden = hidden
+        self.manifest = manifest
+        self.num_workers = max(1, num_workers)
+        self.ordered = ordered
+
+        # listings in flight are bounded to keep memory flat (backpressure)
+        self.max_pending = self.num_workers * 4
+
         self.size = 0
+        self.dirs = 0
+        self.elapsed = 0.0
+        self.slow_dirs = []
 
-    def empty(self):
+    def find(self, path, recursive=False) -> object:
         """
-        Check if queue is empty or not
+        Find all pix files in a given directory. Paths are yielded as soon as
+        their directory is listed, so callers can start working on the first
+        file before the whole tree is scanned.
         """
-        return True if (not self.files) else False
+        self.size = 0
+        self.dirs = 0
+        self.elapsed = 0.0
+        self.slow_dirs = []
+
+        if recursive and 1 < self.num_workers:
+            yield from self.__find_parallel(path)
+        else:
+            yield from self.__find_serial(path, recursive)
 
-    def pop(self):
+    def report(self):
         """
-        Pop an pix file path from the queue.
+        Log scanning statistics and the slowest directories
         """
-        if self.files:
-            self.size -= 1
-            return self.files.popleft()
+        logger.info(f"Scanned {self.dirs} directories, {self.size} file(s)")
 
-        return None
+        if self.slow_dirs:
+            logger.info(f"Directory listing took {self.elapsed:.3f}s in total. Slowest ones:")
 
-    def find(self, path, recursive=False) -> object:
+            for elapsed, path in sorted(self.slow_dirs, reverse=True):
+                logger.info(" * %8.3fs %s" % (elapsed, path))
+
+    def __find_serial(self, path, recursive):
         """
-        Find all pix files in a given directory recursively.
+        Walk a directory tree one directory at a time.
         """
-        self.files = deque()
-        self.size = 0
+        # directories to visit (iterative traversal instead of recursion)
+        stack = [path]
+        visited = set()
+        self.__first_visit(path, visited)
 
-        files = glob.glob(os.path.join(path, "*"))
+        while stack:
+            dir_path, files, subdirs, elapsed = self.__list(stack.pop())
+            self.__record(dir_path, elapsed, len(files))
 
-        for x in files:
-            if os.path.isdir(x):
-                if recursive:
-                    self.__find_subdir(x)
-            else:
-                self.files.append(x)
+            if recursive:
+                for subdir, _ in subdirs:
+                    if self.__first_visit(subdir, visited):
+                        stack.append(subdir)
+
+            for x in files:
                 self.size += 1
+                yield x
 
-    def __find_subdir(self, path):
+    def __find_parallel(self, path):
         """
-        Scan a given directory.
+        Walk a directory tree by listing many directories at once. This hides
+        round-trip latency of network filesystems. Directories are listed by a
+        pool of threads, and only while the consumer keeps pulling files.
         """
-        files = glob.glob(os.path.join(path, "*"))
+        pending = deque([path])
+        running = deque() if self.ordered else set()
+        visited = set()
+        self.__first_visit(path, visited)
 
-        for x in files:
-            if os.path.isdir(x):
-                self.__find_subdir(x)
-            else:
-                self.files.append(x)
-                self.size += 1
+        pool = ThreadPoolExecutor(self.num_workers, thread_name_prefix="pixfinder")
+
+        try:
+            while pending or running:
+                # fill up the pool with pending directories
+                while pending and len(running) < self.max_pending:
+                    future = pool.submit(self.__list, pending.popleft())
+
+                    if self.ordered:
+                        running.append(future)
+                    else:
+                        running.add(future)
+
+                # take listings in submission order, or as they complete
+                if self.ordered:
+                    done = (running.popleft(),)
+                else:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    running.difference_update(done)
+
+                for future in done:
+                    dir_path, files, subdirs, elapsed = future.result()
+                    self.__record(dir_path, elapsed, len(files))
+
+                    for subdir, _ in subdirs:
+                        if self.__first_visit(subdir, visited):
+                            pending.append(subdir)
+
+                    for x in files:
+                        self.size += 1
+                        yield x
+
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def __list(self, path):
+        """
+        List a given directory and split its entries into files and
+        sub-directories (path, is symbolic link). Runs on worker threads.
+        A directory unchanged since the last incremental run is not listed.
+        """
+        files = []
+        subdirs = []
+        names = []
+
+        started = time.perf_counter()
+
+        if self.manifest is not None:
+            unchanged = self.manifest.skip(path)
+
+            if unchanged is not None:
+                logger.debug("Skipped unchanged directory %s", path)
+                return path, files, unchanged, time.perf_counter() - started
+
+        for entry in self.__scan(path):
+            names.append(entry.name)
+
+            if not self.hidden and entry.name.startswith("."):
+                continue
+
+            try:
+                # DirEntry caches d_type, so no extra stat() is needed here
+                if entry.is_dir():
+                    subdirs.append((entry.path, entry.is_symlink()))
+                else:
+                    files.append(entry.path)
+            except OSError:
+                continue
+
+        if self.manifest is not None:
+            files = self.manifest.filter(path, files, subdirs, names)
+
+        elapsed = time.perf_counter() - started
+
+        logger.debug("Listed %s in %.3fs (%d files, %d dirs)", path, elapsed, len(files), len(subdirs))
+
+        return path, files, subdirs, elapsed
+
+    def __record(self, path, elapsed, files):
+        """
+        Record listing time of a directory, keeping the slowest ones only.
+        """
+        self.dirs += 1
+        self.elapsed += elapsed
+
+        if PixMetrics.enabled:
+            PixMetrics.local().stage("scan").add(elapsed, files)
+
+        if len(self.slow_dirs) < self.slow_dirs_max:
+            heapq.heappush(self.slow_dirs, (elapsed, path))
+        elif self.slow_dirs[0][0] < elapsed:
+            heapq.heapreplace(self.slow_dirs, (elapsed, path))
+
+    def __scan(self, path):
+        """
+        List a given directory.
+        """
+        try:
+            with os.scandir(path) as it:
+                yield from it
+        except OSError as e:
+            logger.error(f"Cannot scan directory: {path} ({e.strerror})")
+
+    @staticmethod
+    def __first_visit(path, visited):
+        """
+        Check if a directory is visited for the first time, by its device and
+        inode. Every directory entered is recorded, so a symbolic link to it
+        (or to an ancestor) is not followed again.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+
+        key = (st.st_dev, st.st_ino)
+
+        if key in visited:
+            return False
+
+        visited.add(key)
+        return True
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import time
+import shlex
 import logging
 import os.path
 from threading import Lock as WriteLock
@@ -80,7 +81,7 @@ class PixHistory:
             self.lock.acquire()
             try:
                 # write a history line
-                self.history.write(f"pixwork '{from_path}' '{to_path}'\n")
+                self.history.write(f"pixwork {shlex.quote(from_path)} {shlex.quote(to_path)}\n")
 
             except Exception:
                 logger.error("Cannot write a history line")
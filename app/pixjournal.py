@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+from threading import Lock as WriteLock
+
+from app.common import ENV
+from app.pixmetrics import PixMetrics
+from app.pixhistory import PixHistory
+from app.pixmove import PixMovePlanner
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+JOURNAL_VERSION = 1
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixJournal:
+    """
+    Renaming journal. It is line-delimited JSON: a header, one line per
+    rename sequence of a directory, and a footer written on a clean close.
+    Sequences are written ahead of renaming, a directory at a time, so a
+    crash never leaves renames without a record. Renames are recorded with
+    inode numbers of the files moved, and replaying a sequence checks them
+    against the file system, so renames which were not done (or were
+    replayed already) are skipped.
+    """
+    # seconds between checkpoints (fsync)
+    fsync_interval = 1.0
+
+    def __init__(self, journal_dir=".", bash=False):
+        """
+        Initialization
+        """
+        if not os.path.exists(journal_dir):
+            os.mkdir(journal_dir)
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime())
+        self.path = os.path.join(journal_dir, "journal-%s-%d.jsonl" % (stamp, os.getpid()))
+
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.lock = WriteLock()
+        self.records = 0
+        self.synced = time.monotonic()
+
+        self.__append([json.dumps({"journal": JOURNAL_VERSION, "cwd": os.getcwd(),
+                                   "started": time.time()})])
+
+        # optional bash script, written as renames are done
+        self.bash = PixHistory(journal_dir) if bash else None
+
+        logger.info(f"Start to write renaming journal to {self.path}")
+
+    def write(self, base, sequences):
+        """
+        Write rename sequences of a directory. Records are built by the
+        calling worker, and appended with a single write.
+        """
+        if not sequences:
+            return
+
+        records = [[os.path.abspath(base), PixMovePlanner.fingerprint(base, x)] for x in sequences]
+
+        self.__append([json.dumps(x, ensure_ascii=False) for x in records], len(sequences))
+
+    def writeline(self, from_path, to_path):
+        """
+        Record a rename done (bash script only)
+        """
+        if self.bash:
+            self.bash.writeline(from_path, to_path)
+
+    def close(self):
+        """
+        Write a footer, sync and close the journal
+        """
+        if self.fd is None:
+            return
+
+        self.__append([json.dumps({"closed": time.time(), "records": self.records})])
+
+        os.fsync(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+        if self.bash:
+            self.bash.close()
+
+    @staticmethod
+    def read(journal_path):
+        """
+        Iterate over rename sequences (directory, renames) of a journal.
+        Renames are (from name, to name, inode or None).
+        """
+        closed = False
+
+        with open(journal_path, "r", encoding="utf-8", errors="surrogateescape") as f:
+            header = json.loads(f.readline() or "{}")
+
+            if header.get("journal") != JOURNAL_VERSION:
+                raise ValueError(f"Not a renaming journal: {journal_path}")
+
+            for num, line in enumerate(f, 2):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn last line of an interrupted run
+                    logger.warning(f"Broken journal line {num}, skipped: {journal_path}")
+                    continue
+
+                if isinstance(record, dict):
+                    closed = "closed" in record
+                    continue
+
+                base, sequence = record
+                yield base, [tuple(x) for x in sequence]
+
+        if not closed:
+            logger.warning(f"Journal of an interrupted run: {journal_path}")
+
+    def __append(self, lines, records=0):
+        """
+        Append lines at once, and sync the file at checkpoint intervals
+        """
+        data = memoryview(("\n".join(lines) + "\n").encode("utf-8", "surrogateescape"))
+        started = time.perf_counter()
+        size = len(data)
+
+        # the lock is taken once per directory, not per rename
+        with self.lock:
+            while data:
+                data = data[os.write(self.fd, data):]
+
+            self.records += records
+
+            now = time.monotonic()
+
+            if self.fsync_interval <= now - self.synced:
+                os.fsync(self.fd)
+                self.synced = now
+
+        if PixMetrics.enabled:
+            PixMetrics.record("journal", started, len(lines), size)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+from itertools import count
+
+from app.common import ENV
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+# background threads writing log records, if queued logging is enabled
+listeners = []
+
+
+# ==========================================================
+# FUNCTIONS
+# ==========================================================
+def setup_logging(config):
+    """
+    Configure logging by a dictionary config. If "queue" is set in the
+    config, handlers of each logger are moved to a background thread, and
+    the logger only puts records into a queue.
+    """
+    import logging.config
+
+    queued = config.pop("queue", False)
+    logging.config.dictConfig(config)
+
+    if not queued:
+        return
+
+    for name in [None] + list(config.get("loggers", {}).keys()):
+        target = logging.getLogger(name)
+
+        if target.handlers:
+            records = queue.SimpleQueue()
+
+            listener = logging.handlers.QueueListener(records, *target.handlers, respect_handler_level=True)
+            listener.start()
+            listeners.append(listener)
+
+            target.handlers = [PixQueueHandler(records)]
+
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Write out queued log records and stop the background threads
+    """
+    while listeners:
+        listeners.pop().stop()
+
+
+def worker_logging(records, level):
+    """
+    Set up logging of a worker process (used as a pool initializer). Log
+    records are sent to the main process through a queue, and handled there
+    as configured.
+    """
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(records)]
+    root.setLevel(level)
+
+
+def forward_logging(records) -> object:
+    """
+    Start a background thread which handles log records of worker processes
+    by loggers of this process. Returns the listener, to be stopped.
+    """
+    listener = logging.handlers.QueueListener(records, PixForwardHandler())
+    listener.start()
+
+    return listener
+
+
+def emit_lines(lines):
+    """
+    Show lines of a preview at once: written to stdout in a single call (or
+    logged as a single record in prd)
+    """
+    if not lines:
+        return
+
+    if ENV == "prd":
+        logger.info("\n".join(lines))
+    else:
+        sys.stdout.write("\n".join(lines) + "\n")
+
+
+# ==========================================================
+# CLASS IMPLEMETATIONS
+# ==========================================================
+class PixQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler which leaves formatting to the listener thread. Records
+    stay in the process, so they are queued as they are.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class PixForwardHandler(logging.Handler):
+    """
+    Handler which passes log records of worker processes on to the loggers
+    of the same names
+    """
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+class PixTrace:
+    """
+    Sampled per-file trace. Per-file log lines are off by default, and only
+    every n-th file is traced if enabled.
+    """
+    # trace every n-th file (0: off)
+    every = 0
+
+    # shared counter of traced events (next() is atomic)
+    events = count()
+
+    def __new__(cls, *args, **kwargs):
+        raise RuntimeError('%s should not be instantiated' % cls)
+
+    @classmethod
+    def enable(cls, rate):
+        """
+        Enable trace for a given fraction of files (0 < rate <= 1)
+        """
+        cls.every = max(1, round(1 / rate)) if 0 < rate else 0
+
+        if cls.every:
+            logger.info(f"Trace 1 of every {cls.every} file(s)")
+
+    @classmethod
+    def sample(cls) -> bool:
+        """
+        Check if the current file is traced
+        """
+        return 0 < cls.every and next(cls.events) % cls.every == 0
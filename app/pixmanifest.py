@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+
+from app.common import ENV
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# default manifest file name (created in the input directory)
+MANIFEST_FILE = ".pixmanifest.jsonl"
+
+MANIFEST_VERSION = 1
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixManifest:
+    """
+    Run manifest for incremental runs. It is line-delimited JSON: a header
+    and one line per directory with its mtime, sub-directories and names of
+    files already stamped. A directory whose mtime is unchanged since the
+    last run is not listed again, and already stamped files of a changed
+    directory are skipped but keep their names reserved.
+    """
+
+    def __init__(self, manifest_path, root):
+        """
+        Initialization
+        """
+        self.path = os.path.abspath(manifest_path)
+        self.root = root
+
+        # entries of the last run: directory -> (mtime, subdirs, links, names)
+        self.entries = {}
+
+        # directories of this run (set from scanning threads, and a dict
+        # item assignment is atomic): directory -> subdirs, or listing
+        self.unchanged = {}
+        self.listed = {}
+
+        # names reserved by stamped files, and renames planned in a directory
+        self.stamped = {}
+        self.planned = {}
+
+        self.__load()
+
+    def skip(self, dir_path) -> list:
+        """
+        Return sub-directories (path, is symbolic link) of a directory if it
+        is unchanged since the last run, or None to list it
+        """
+        key = os.path.normpath(dir_path)
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] is None:
+            return None
+
+        try:
+            if os.stat(dir_path).st_mtime_ns != entry[0]:
+                return None
+        except OSError:
+            return None
+
+        self.unchanged[key] = entry
+
+        _, subdirs, links, _ = entry
+        links = set(links)
+
+        return [(os.path.join(dir_path, x), x in links) for x in subdirs]
+
+    def filter(self, dir_path, files, subdirs, names) -> list:
+        """
+        Record a listing of a changed directory, and return its files which
+        are not stamped yet. Names are all entries of the listing.
+        """
+        key = os.path.normpath(dir_path)
+        entry = self.entries.get(key)
+        stamped = set(entry[3]) if entry else set()
+
+        stamped &= set(names)
+
+        self.listed[key] = (names, [(os.path.basename(x), is_link) for x, is_link in subdirs])
+        self.stamped[key] = stamped
+
+        # the manifest itself is never a pix file
+        if os.path.abspath(dir_path) == os.path.dirname(self.path):
+            stamped = stamped | {os.path.basename(self.path)}
+
+        return [x for x in files if os.path.basename(x) not in stamped]
+
+    def taken(self, dir_path) -> set:
+        """
+        Return names of stamped files kept in a directory
+        """
+        return self.stamped.get(os.path.normpath(dir_path), ())
+
+    def plan(self, dir_path, moves):
+        """
+        Record renames (from name, to name) planned in a directory
+        """
+        self.planned.setdefault(os.path.normpath(dir_path), []).extend(moves)
+
+    def save(self):
+        """
+        Write the manifest of this run. A changed directory is recorded with
+        its current mtime only if all of its files have been stamped or seen;
+        otherwise, it is listed again next time.
+        """
+        # create the manifest file before taking mtimes, and later write it
+        # in place, so that it does not change the mtime of its directory
+        try:
+            open(self.path, "a").close()
+        except OSError as e:
+            logger.error(f"Cannot write manifest: {self.path} ({e.strerror})")
+            return
+
+        home = os.path.dirname(self.path)
+
+        lines = [json.dumps({"manifest": MANIFEST_VERSION, "root": os.path.abspath(self.root),
+                             "saved": time.time()})]
+
+        for key, (mtime, subdirs, links, names) in self.unchanged.items():
+            lines.append(self.__line(key, mtime, subdirs, links, names))
+
+        complete = 0
+
+        for key, (seen, subdirs) in self.listed.items():
+            moves = self.planned.get(key, ())
+            targets = {y for _, y in moves}
+            sources = {x for x, y in moves if x != y} - targets
+
+            try:
+                mtime = os.stat(key).st_mtime_ns
+                names = set(os.listdir(key))
+            except OSError as e:
+                logger.warning(f"Cannot list directory: {key} ({e.strerror}), not recorded")
+                continue
+
+            seen = set(seen)
+
+            if os.path.abspath(key) == home:
+                seen.add(os.path.basename(self.path))
+
+            # a file is left unrenamed, or showed up after listing
+            if sources & names or not names <= seen | targets:
+                mtime = None
+            else:
+                complete += 1
+
+            stamped = (self.stamped[key] | targets) & names
+
+            lines.append(self.__line(key, mtime, [x for x, _ in subdirs],
+                                     [x for x, is_link in subdirs if is_link], sorted(stamped)))
+
+        # a torn manifest is rejected when loaded, which falls back to a full run
+        try:
+            with open(self.path, "w", encoding="utf-8", errors="surrogateescape") as f:
+                f.write("\n".join(lines) + "\n")
+
+        except OSError as e:
+            logger.error(f"Cannot write manifest: {self.path} ({e.strerror})")
+            return
+
+        logger.info(f"Saved manifest of {len(lines) - 1} directories to {self.path} "
+                    f"({len(self.unchanged) + complete} up to date)")
+
+    def skipped(self) -> set:
+        """
+        Return absolute paths of directories skipped as unchanged
+        """
+        return {os.path.abspath(x) for x in self.unchanged}
+
+    def report(self):
+        """
+        Log what was skipped by the manifest
+        """
+        logger.info(f"Incremental run: {len(self.unchanged)} unchanged directories skipped, "
+                    f"{sum(len(x) for x in self.stamped.values())} stamped file(s) skipped")
+
+    def __line(self, key, mtime, subdirs, links, names) -> str:
+        """
+        Return a manifest line of a directory
+        """
+        return json.dumps([os.path.relpath(key, self.root), mtime, subdirs, links, names],
+                          ensure_ascii=False, separators=(",", ":"))
+
+    def __load(self):
+        """
+        Load the manifest of the last run, if any
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8", errors="surrogateescape") as f:
+                header = json.loads(f.readline() or "{}")
+
+                if header.get("manifest") != MANIFEST_VERSION:
+                    raise ValueError("not a manifest")
+
+                for line in f:
+                    rel, mtime, subdirs, links, names = json.loads(line)
+                    key = os.path.normpath(os.path.join(self.root, rel))
+                    self.entries[key] = (mtime, subdirs, links, names)
+
+        except FileNotFoundError:
+            logger.info(f"No manifest at {self.path}, start a full run")
+            return
+
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot read manifest: {self.path} ({e}), start a full run")
+            self.entries = {}
+            return
+
+        logger.info(f"Use manifest of {len(self.entries)} directories at {self.path}")
@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+import io
+import re
+import zlib
+import struct
+import logging
+from datetime import datetime
+
+from app.common import ENV
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# seconds between 1904-01-01 (QuickTime epoch) and 1970-01-01 (UNIX epoch)
+QT_EPOCH_OFFSET = 2082844800
+
+# maximum number of boxes visited in one container (guards broken files)
+BOX_COUNT_MAX = 4096
+
+# PNG file signature
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG chunks which may carry timestamps, and the text keyword for it
+PNG_META_CHUNKS = (b"eXIf", b"tEXt", b"zTXt", b"iTXt")
+PNG_TIME_KEYWORD = b"Creation Time"
+
+# metadata chunks larger than this are skipped, not read
+PNG_CHUNK_MAX = 64 * 1024
+
+# maximum number of chunks visited in one file (guards broken files)
+PNG_CHUNK_COUNT_MAX = 65536
+
+# JPEG markers: start of image, APP1, start of scan (image data follows) and
+# end of image, and ones without a segment (TEM, RSTn)
+JPEG_SOI = b"\xff\xd8"
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+JPEG_EOI = 0xD9
+JPEG_STANDALONE = (0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7)
+
+# maximum number of segments visited before image data (guards broken files)
+JPEG_SEGMENT_COUNT_MAX = 256
+
+# TIFF tags: Exif IFD pointer (in IFD0) and timestamps (in Exif IFD)
+TIFF_EXIF_IFD = 0x8769
+TIFF_DATETIME_ORIGINAL = 0x9003
+TIFF_SUBSEC_TIME_ORIGINAL = 0x9291
+
+# TIFF field types
+TIFF_ASCII = 2
+TIFF_LONG = 4
+TIFF_IFD = 13
+
+# maximum number of entries in one IFD (guards broken files)
+TIFF_ENTRY_COUNT_MAX = 1024
+
+# EXIF date and time: "YYYY:MM:DD HH:MM:SS"
+EXIF_DATETIME = re.compile(rb"(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})")
+
+
+# ==========================================================
+# FUNCTIONS
+# ==========================================================
+def parse_datetime(text) -> object:
+    """
+    Parse a timestamp string in EXIF, ISO 8601 or RFC 1123 format. Time zone
+    information is dropped, so the local time of the writer is kept.
+    """
+    text = text.strip().rstrip("\x00")
+
+    try:
+        return datetime.strptime(text, "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        pass
+
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        pass
+
+    # RFC 1123 is the rarest, and its parser is slow to import
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return parsedate_to_datetime(text).replace(tzinfo=None)
+    except (TypeError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+# ==========================================================
+# CLASS IMPLEMETATIONS
+# ==========================================================
+class PixExifReader:
+    """
+    EXIF timestamp reader. It walks only IFD0 and the Exif IFD in place, with
+    struct.unpack_from over a memoryview, and falls back to exifread only if
+    the data is malformed.
+    """
+    def __new__(cls, *args, **kwargs):
+        raise RuntimeError('%s should not be instantiated' % cls)
+
+    @classmethod
+    def datetime_original(cls, buf, fh=None) -> object:
+        """
+        Return DateTimeOriginal of a JPEG/TIFF file (or raw EXIF data) as
+        datetime object, or None. A given buffer is usually a mmap of the
+        file, which is also given as a file object for the fallback.
+        Milliseconds are taken from SubSecTimeOriginal, if present. The
+        datetime is naive (local wall-clock time), as from other rules.
+        """
+        if buf is None:
+            return None
+
+        try:
+            with memoryview(buf) as view:
+                return cls.__read(view)
+
+        except (struct.error, ValueError, IndexError):
+            logger.debug("Malformed EXIF data, parse it by exifread")
+
+        if fh is not None:
+            fh.seek(0)
+        else:
+            fh = io.BytesIO(buf)
+
+        return cls.datetime_original_exifread(fh)
+
+    @staticmethod
+    def datetime_original_exifread(fh) -> object:
+        """
+        Return DateTimeOriginal of a given JPEG/TIFF file (or raw EXIF data)
+        as datetime object by exifread, or None. Parsing stops at the tag.
+        """
+        # imported on first use (malformed data only), since it is slow to import
+        import exifread
+
+        try:
+            exif = exifread.process_file(fh, stop_tag="DateTimeOriginal", details=False)
+
+        # exifread is not hardened against truncated or corrupted files
+        except Exception as e:
+            logger.debug("Cannot parse EXIF data by exifread (%r)", e)
+            return None
+
+        if "EXIF DateTimeOriginal" in exif.keys():
+            try:
+                return datetime.strptime(exif["EXIF DateTimeOriginal"].values, "%Y:%m:%d %H:%M:%S")
+            except (TypeError, ValueError):
+                logger.debug("Invalid DateTimeOriginal: %s", exif["EXIF DateTimeOriginal"])
+
+        return None
+
+    @classmethod
+    def __read(cls, view) -> object:
+        """
+        Find TIFF data in a JPEG APP1 segment or a TIFF file, and return its
+        DateTimeOriginal. Raises struct.error or ValueError if malformed.
+        """
+        if view[:2] == JPEG_SOI:
+            tiff = cls.__jpeg_exif(view)
+            if tiff is None:
+                return None
+        else:
+            tiff = 0
+
+        tags = cls.__exif_tags(view, tiff)
+        dto = tags.get(TIFF_DATETIME_ORIGINAL)
+
+        if dto is None:
+            return None
+
+        # built from integers instead of strptime (much faster)
+        m = EXIF_DATETIME.fullmatch(dto)
+
+        try:
+            if m is None:
+                raise ValueError("unknown format")
+
+            dt = datetime(*map(int, m.groups()))
+
+        except ValueError:
+            logger.debug("Invalid DateTimeOriginal: %s", dto)
+            return None
+
+        subsec = tags.get(TIFF_SUBSEC_TIME_ORIGINAL, b"").strip()
+
+        if subsec.isdigit():
+            dt = dt.replace(microsecond=int((subsec + b"000000")[:6]))
+
+        return dt
+
+    @staticmethod
+    def __jpeg_exif(view) -> int:
+        """
+        Return the offset of TIFF data in the EXIF APP1 segment of a JPEG
+        file, or None. Walking stops at image data.
+        """
+        off = 2
+
+        for _ in range(JPEG_SEGMENT_COUNT_MAX):
+            marker, kind = struct.unpack_from(">BB", view, off)
+
+            if marker != 0xFF:
+                raise ValueError("not a JPEG marker")
+
+            if kind == JPEG_SOS or kind == JPEG_EOI:
+                break
+
+            # fill bytes, and markers without a segment
+            if kind == 0xFF:
+                off += 1
+                continue
+
+            if kind in JPEG_STANDALONE:
+                off += 2
+                continue
+
+            size, = struct.unpack_from(">H", view, off + 2)
+
+            if kind == JPEG_APP1 and view[off + 4:off + 10] == b"Exif\x00\x00":
+                return off + 10
+
+            off += 2 + size
+
+        return None
+
+    @classmethod
+    def __exif_tags(cls, view, tiff) -> dict:
+        """
+        Return timestamp tags (tag -> bytes) of the Exif IFD of TIFF data at
+        a given offset. Offsets in TIFF data are relative to its header.
+        """
+        order = view[tiff:tiff + 2]
+
+        if order == b"II":
+            e = "<"
+        elif order == b"MM":
+            e = ">"
+        else:
+            raise ValueError("unknown byte order")
+
+        magic, ifd0 = struct.unpack_from(e + "HI", view, tiff + 2)
+
+        if magic != 42:
+            raise ValueError("not TIFF data")
+
+        exif_ifd = None
+
+        for tag, kind, count, value, pos in cls.__entries(view, tiff, ifd0, e):
+            if tag == TIFF_EXIF_IFD and kind in (TIFF_LONG, TIFF_IFD):
+                exif_ifd = value
+                break
+
+        if exif_ifd is None:
+            return {}
+
+        tags = {}
+
+        for tag, kind, count, value, pos in cls.__entries(view, tiff, exif_ifd, e):
+            if tag in (TIFF_DATETIME_ORIGINAL, TIFF_SUBSEC_TIME_ORIGINAL) and kind == TIFF_ASCII:
+                # values of 4 bytes or less are stored in the entry itself
+                start = pos if count <= 4 else tiff + value
+
+                if len(view) < start + count:
+                    raise ValueError("value out of range")
+
+                tags[tag] = bytes(view[start:start + count]).split(b"\x00", 1)[0]
+
+        return tags
+
+    @staticmethod
+    def __entries(view, tiff, ifd, e):
+        """
+        Iterate over (tag, type, count, value or offset, value position) of
+        entries of an IFD
+        """
+        off = tiff + ifd
+        count, = struct.unpack_from(e + "H", view, off)
+
+        if TIFF_ENTRY_COUNT_MAX < count:
+            raise ValueError("too many IFD entries")
+
+        for i in range(count):
+            pos = off + 2 + i * 12
+            tag, kind, n, value = struct.unpack_from(e + "HHII", view, pos)
+
+            yield tag, kind, n, value, pos + 8
+
+
+class PixChunkReader:
+    """
+    Minimal PNG chunk reader. It reads chunk headers only and seeks past
+    chunk data, except for small metadata chunks.
+    """
+    def __new__(cls, *args, **kwargs):
+        raise RuntimeError('%s should not be instantiated' % cls)
+
+    @classmethod
+    def creation_time(cls, fh) -> object:
+        """
+        Return a timestamp from eXIf or text (Creation Time) chunks of a PNG
+        file as datetime object, or None. If metadata chunks come before image
+        data, walking stops at the first IDAT chunk.
+        """
+        fh.seek(0)
+
+        if fh.read(8) != PNG_SIGNATURE:
+            return None
+
+        seen_meta = False
+
+        for _ in range(PNG_CHUNK_COUNT_MAX):
+            header = fh.read(8)
+            if len(header) < 8:
+                break
+
+            size, kind = struct.unpack(">I4s", header)
+
+            if kind == b"IEND" or (kind == b"IDAT" and seen_meta):
+                break
+
+            if kind in PNG_META_CHUNKS and size <= PNG_CHUNK_MAX:
+                seen_meta = True
+
+                data = fh.read(size)
+                if len(data) < size:
+                    break
+
+                dt = cls.__chunk_time(kind, data)
+                if dt is not None:
+                    return dt
+
+                # skip crc
+                fh.seek(4, io.SEEK_CUR)
+            else:
+                # skip data and crc
+                fh.seek(size + 4, io.SEEK_CUR)
+
+        return None
+
+    @staticmethod
+    def __chunk_time(kind, data) -> object:
+        """
+        Extract a timestamp from a metadata chunk
+        """
+        try:
+            if kind == b"eXIf":
+                return PixExifReader.datetime_original(data)
+
+            keyword, _, text = data.partition(b"\x00")
+            if keyword != PNG_TIME_KEYWORD:
+                return None
+
+            if kind == b"zTXt":
+                # compression method (1 byte) and compressed text
+                text = zlib.decompress(text[1:])
+
+            elif kind == b"iTXt":
+                # compression flag and method, language tag and translated keyword
+                compressed = text[0]
+                _, _, text = text[2:].partition(b"\x00")
+                _, _, text = text.partition(b"\x00")
+                if compressed:
+                    text = zlib.decompress(text)
+
+                return parse_datetime(text.decode("utf-8", "replace"))
+
+            return parse_datetime(text.decode("latin-1"))
+
+        except (zlib.error, IndexError):
+            logger.debug("Malformed PNG %s chunk", kind)
+
+        return None
+
+
+class PixAtomReader:
+    """
+    Minimal ISO base media file (MP4/MOV) reader. It walks box (atom) headers
+    only, so media payloads are never read.
+    """
+    def __new__(cls, *args, **kwargs):
+        raise RuntimeError('%s should not be instantiated' % cls)
+
+    @classmethod
+    def creation_time(cls, buf) -> int:
+        """
+        Return creation time of a movie as UNIX epoch seconds, or None. A given
+        buffer is usually a mmap of the file. Movie header (mvhd) is checked
+        first, then track (tkhd) and media (mdhd) headers.
+        """
+        try:
+            moov = cls.find(buf, 0, len(buf), b"moov")
+            if moov is None:
+                return None
+
+            mvhd = cls.find(buf, *moov, b"mvhd")
+            secs = cls.__header_time(buf, mvhd)
+
+            # fall back to track headers
+            for trak in cls.iterate(buf, *moov, b"trak"):
+                if secs:
+                    break
+
+                secs = cls.__header_time(buf, cls.find(buf, *trak, b"tkhd"))
+
+                if not secs:
+                    mdia = cls.find(buf, *trak, b"mdia")
+                    if mdia is not None:
+                        secs = cls.__header_time(buf, cls.find(buf, *mdia, b"mdhd"))
+
+        except (struct.error, ValueError):
+            logger.debug("Malformed movie atoms")
+            return None
+
+        # unset (zero) or pre-1970 times are not usable
+        return secs - QT_EPOCH_OFFSET if secs and QT_EPOCH_OFFSET < secs else None
+
+    @classmethod
+    def find(cls, buf, start, end, box_type) -> tuple:
+        """
+        Find the first box of a given type in [start, end) and return its
+        payload range (start, end), or None
+        """
+        for box in cls.iterate(buf, start, end, box_type):
+            return box
+
+        return None
+
+    @staticmethod
+    def iterate(buf, start, end, box_type=None):
+        """
+        Iterate over payload ranges of boxes (of a given type) in [start, end)
+        """
+        off = start
+
+        for _ in range(BOX_COUNT_MAX):
+            if end < off + 8:
+                break
+
+            size, kind = struct.unpack_from(">I4s", buf, off)
+            header = 8
+
+            if size == 1:
+                # 64-bit box size follows the type
+                size, = struct.unpack_from(">Q", buf, off + 8)
+                header = 16
+            elif size == 0:
+                # box extends to the end of its container
+                size = end - off
+
+            if size < header or end < off + size:
+                break
+
+            if box_type is None or kind == box_type:
+                yield off + header, off + size
+
+            off += size
+
+    @staticmethod
+    def __header_time(buf, box) -> int:
+        """
+        Read creation time of a full box (mvhd, tkhd or mdhd). Times are
+        32-bit in version 0 and 64-bit in version 1.
+        """
+        if box is None:
+            return None
+
+        start, end = box
+
+        # version, flags and a 32-bit time at least (may be cut off at EOF)
+        if end < start + 8:
+            return None
+
+        version = buf[start]
+
+        if version == 1:
+            return struct.unpack_from(">Q", buf, start + 4)[0] if start + 12 <= end else None
+
+        return struct.unpack_from(">I", buf, start + 4)[0] if start + 8 <= end else None
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import io
+import sys
+import json
+import time
+import logging
+from threading import Lock, local
+
+from app.common import ENV
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# latency histogram buckets: powers of 2 in microseconds, up to ~16s
+HIST_BUCKETS = 25
+
+# number of entries in profile summaries
+PROFILE_TOP = 20
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixStageMetrics:
+    """
+    Metrics of a stage: number of events and items, bytes read (None if
+    not known), and a latency histogram with power-of-2 buckets in
+    microseconds
+    """
+    __slots__ = ("count", "items", "bytes", "elapsed", "max", "hist")
+
+    def __init__(self):
+        """
+        Initialization
+        """
+        self.count = 0
+        self.items = 0
+        self.bytes = None
+        self.elapsed = 0.0
+        self.max = 0.0
+        self.hist = [0] * HIST_BUCKETS
+
+    def add(self, elapsed, items=1, nbytes=0):
+        """
+        Record an event
+        """
+        self.count += 1
+        self.items += items
+
+        if nbytes is not None:
+            self.bytes = (self.bytes or 0) + nbytes
+        self.elapsed += elapsed
+
+        if self.max < elapsed:
+            self.max = elapsed
+
+        self.hist[min(int(elapsed * 1e6).bit_length(), HIST_BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        """
+        Add up metrics of another stage
+        """
+        self.count += other.count
+        self.items += other.items
+
+        if other.bytes is not None:
+            self.bytes = (self.bytes or 0) + other.bytes
+        self.elapsed += other.elapsed
+        self.max = max(self.max, other.max)
+        self.hist = [x + y for x, y in zip(self.hist, other.hist)]
+
+    def percentile(self, p) -> float:
+        """
+        Return the upper bound (seconds) of the bucket holding a percentile
+        """
+        rank = self.count * p / 100
+
+        for i, n in enumerate(self.hist):
+            rank -= n
+
+            if rank <= 0:
+                return min((1 << i) / 1e6, self.max)
+
+        return self.max
+
+    def asdict(self) -> dict:
+        """
+        Return metrics as a dictionary (times in milliseconds)
+        """
+        return {
+            "count": self.count,
+            "items": self.items,
+            "bytes": self.bytes,
+            "total_ms": round(self.elapsed * 1e3, 3),
+            "mean_ms": round(self.elapsed * 1e3 / self.count, 4) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1e3, 4),
+            "p90_ms": round(self.percentile(90) * 1e3, 4),
+            "p99_ms": round(self.percentile(99) * 1e3, 4),
+            "max_ms": round(self.max * 1e3, 4),
+            "histogram_us": {"<%d" % (1 << i): n for i, n in enumerate(self.hist) if n},
+        }
+
+
+class PixMetrics:
+    """
+    Per-stage metrics. Each thread records into its own metrics object, so
+    no lock is taken on hot paths, and they are merged for a report. Recording
+    is off unless enabled.
+    """
+    enabled = False
+
+    # metrics of all threads, and the ones of the current thread
+    registry = []
+    registry_lock = Lock()
+    current = local()
+
+    def __init__(self):
+        """
+        Initialization
+        """
+        self.stages = {}
+
+    def stage(self, name) -> PixStageMetrics:
+        """
+        Return metrics of a given stage
+        """
+        stage = self.stages.get(name)
+
+        if stage is None:
+            stage = self.stages[name] = PixStageMetrics()
+
+        return stage
+
+    def merge(self, other):
+        """
+        Add up metrics of another object
+        """
+        for name, stage in other.stages.items():
+            self.stage(name).merge(stage)
+
+    def asdict(self) -> dict:
+        """
+        Return metrics of all stages as a dictionary
+        """
+        return {name: self.stages[name].asdict() for name in sorted(self.stages)}
+
+    @classmethod
+    def local(cls) -> object:
+        """
+        Return metrics of the current thread
+        """
+        metrics = getattr(cls.current, "metrics", None)
+
+        if metrics is None:
+            metrics = cls.current.metrics = PixMetrics()
+
+            with cls.registry_lock:
+                cls.registry.append(metrics)
+
+        return metrics
+
+    @classmethod
+    def record(cls, name, started, items=1, nbytes=0):
+        """
+        Record an event of a stage, which started at a given perf_counter()
+        """
+        cls.local().stage(name).add(time.perf_counter() - started, items, nbytes)
+
+    @classmethod
+    def collect(cls) -> object:
+        """
+        Return metrics merged over all threads
+        """
+        merged = PixMetrics()
+
+        with cls.registry_lock:
+            for metrics in cls.registry:
+                merged.merge(metrics)
+
+        return merged
+
+    @classmethod
+    def take(cls) -> object:
+        """
+        Return metrics merged over all threads and reset them. Used to send
+        metrics from worker processes.
+        """
+        with cls.registry_lock:
+            merged = PixMetrics()
+
+            for metrics in cls.registry:
+                merged.merge(metrics)
+                metrics.stages = {}
+
+        return merged
+
+
+class PixReport:
+    """
+    Machine-readable run report. It enables metrics for a run, and
+    optionally profiles it by cProfile (main thread) and tracemalloc.
+    """
+
+    def __init__(self, report_path, profile=False):
+        """
+        Initialization
+        """
+        self.path = report_path
+        self.profiler = None
+        self.started = time.time()
+        self.clock = time.perf_counter()
+
+        PixMetrics.enabled = True
+
+        if profile:
+            import cProfile
+            import tracemalloc
+
+            tracemalloc.start()
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def close(self):
+        """
+        Stop profiling and write the report
+        """
+        report = {
+            "started": self.started,
+            "elapsed_s": round(time.perf_counter() - self.clock, 3),
+            "argv": sys.argv,
+            "stages": PixMetrics.collect().asdict(),
+        }
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            report["profile"] = self.__profile()
+            report["memory"] = self.__memory()
+
+        with open(self.path, "w") as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+
+        logger.info(f"Run report is written to {self.path}")
+
+    def __profile(self) -> dict:
+        """
+        Save profile data next to the report, and return the top functions
+        by cumulative time
+        """
+        import pstats
+
+        prof_path = self.path.rsplit(".", 1)[0] + ".prof"
+        self.profiler.dump_stats(prof_path)
+
+        stats = pstats.Stats(self.profiler, stream=io.StringIO()).sort_stats("cumulative")
+        top = []
+
+        for func in stats.fcn_list[:PROFILE_TOP]:
+            calls, _, tottime, cumtime, _ = stats.stats[func]
+            top.append({"function": "%s:%d(%s)" % func, "calls": calls,
+                        "tottime_s": round(tottime, 4), "cumtime_s": round(cumtime, 4)})
+
+        logger.info(f"Profile data is written to {prof_path}")
+
+        return {"path": prof_path, "top": top}
+
+    @staticmethod
+    def __memory() -> dict:
+        """
+        Return peak traced memory and the top allocation sites
+        """
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        top = [{"site": str(x.traceback), "bytes": x.size, "blocks": x.count}
+               for x in snapshot.statistics("lineno")[:PROFILE_TOP]]
+
+        return {"current_bytes": current, "peak_bytes": peak, "top": top}
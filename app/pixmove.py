@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import logging
+from itertools import count
+
+from app.common import ENV
+from app.pixlog import PixTrace
+from app.pixdir import DIR_HANDLES
+from app.pixmetrics import PixMetrics
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# prefix of temporary names used to break rename cycles (hidden, so a
+# leftover is never picked up as a pix file)
+TEMP_PREFIX = ".pixmove-"
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixMovePlanner:
+    """
+    Collision-safe rename planner for a directory. Renames are ordered so
+    that no file is ever overwritten: chains are renamed from their free end,
+    and cycles are broken with a temporary name. Files are listed and renamed
+    relative to a handle of the directory (if supported).
+    """
+    # temporary name counter, shared by all planners of a process
+    temp_ids = count()
+
+    def __new__(cls, *args, **kwargs):
+        raise RuntimeError('%s should not be instantiated' % cls)
+
+    @classmethod
+    def plan(cls, base, moves) -> tuple:
+        """
+        Plan renames (from name, to name) in a given directory. Returns a list
+        of sequences and a list of blocked renames. Renames in a sequence must
+        be done in order, while sequences are independent of each other.
+        A rename is blocked if its target is taken by a file which does not
+        move away, or by another rename.
+        """
+        started = time.perf_counter()
+
+        try:
+            with DIR_HANDLES.opened(base) as dir_fd:
+                names = set(os.listdir(dir_fd if dir_fd is not None else base))
+        except OSError as e:
+            logger.error(f"Cannot list directory: {base} ({e.strerror})")
+            return [], list(moves)
+
+        pending = {}
+        by_dst = {}
+        blocked = []
+
+        for src, dst in moves:
+            if dst in by_dst or src in pending:
+                blocked.append((src, dst))
+            else:
+                pending[src] = dst
+                by_dst[dst] = src
+
+        # targets taken by files staying in place
+        stuck = [src for src, dst in pending.items() if dst in names and dst not in pending]
+
+        while stuck:
+            src = stuck.pop()
+            blocked.append((src, pending.pop(src)))
+
+            # the file stays, so a rename into its name is blocked as well
+            prev = by_dst.pop(src, None)
+            if prev in pending:
+                stuck.append(prev)
+
+        for src, dst in blocked:
+            if by_dst.get(dst) == src:
+                del by_dst[dst]
+
+        sequences = []
+
+        # chains: start with the rename into a free name, then follow renames
+        # into names freed up by the previous one
+        for src in [src for src, dst in pending.items() if dst not in pending]:
+            sequences.append(cls.__follow(src, pending, by_dst, []))
+
+        # cycles: move one file aside, rename the rest as a chain, and move
+        # the file to its target at last
+        while pending:
+            src, dst = pending.popitem()
+            temp = cls.__temp_name(names)
+
+            sequence = cls.__follow(by_dst[src], pending, by_dst, [(src, temp)])
+            sequence.append((temp, dst))
+
+            sequences.append(sequence)
+
+        if PixMetrics.enabled:
+            PixMetrics.record("plan", started, len(moves))
+
+        return sequences, blocked
+
+    @staticmethod
+    def execute(base, sequence, history=None) -> int:
+        """
+        Rename files of a sequence in order. A sequence is stopped if a target
+        has shown up since planning, since later renames would overwrite it.
+        Returns the number of renamed files.
+        """
+        renamed = 0
+
+        with DIR_HANDLES.opened(base) as dir_fd:
+            for src, dst in sequence:
+                from_path = os.path.join(base, src)
+                to_path = os.path.join(base, dst)
+
+                if PixTrace.sample():
+                    logger.info(" [A] %s <-- %s (@%s)", dst, src, base)
+
+                started = time.perf_counter()
+
+                # names relative to the directory handle, or paths
+                src_ref, dst_ref = (src, dst) if dir_fd is not None else (from_path, to_path)
+
+                try:
+                    if PixMovePlanner.__taken(src_ref, dst_ref, dir_fd):
+                        raise FileExistsError(0, "Target exists")
+
+                    os.rename(src_ref, dst_ref, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+
+                    if PixMetrics.enabled:
+                        PixMetrics.record("rename", started)
+
+                except OSError as e:
+                    logger.error(f"Cannot rename file: {from_path} -> {dst} ({e.strerror}), "
+                                 f"{len(sequence) - renamed - 1} dependent rename(s) skipped")
+                    break
+
+                renamed += 1
+
+                if history is not None:
+                    history.writeline(from_path, to_path)
+
+        return renamed
+
+    @staticmethod
+    def fingerprint(base, sequence) -> list:
+        """
+        Return renames of a sequence with inode numbers of the files moved:
+        (from name, to name, inode or None). Taken before renaming, so a
+        replay can tell how far the sequence was done. Renames which already
+        have one are kept as they are.
+        """
+        renames = []
+
+        # file moved into a (temporary) name by an earlier rename
+        moved = {}
+
+        with DIR_HANDLES.opened(base) as dir_fd:
+            for src, dst, *ino in sequence:
+                if ino:
+                    ino = ino[0]
+                elif src in moved:
+                    ino = moved.pop(src)
+                else:
+                    ino = PixMovePlanner.__inode(base, src, dir_fd)
+
+                moved[dst] = ino
+                renames.append((src, dst, ino))
+
+        return renames
+
+    @classmethod
+    def replay(cls, base, sequence, history=None) -> int:
+        """
+        Rename files of a recorded sequence (from name, to name, inode) in
+        order. The sequence is matched against the file system first, to
+        tell how many of its renames are done, and only the rest is done.
+        A sequence which matches no state (files changed since), or more
+        than one, is skipped, and so is the rest of a sequence once a
+        rename fails. So replaying is safe to repeat. Returns the number of
+        renamed files.
+        """
+        renamed = 0
+
+        with DIR_HANDLES.opened(base) as dir_fd:
+            done = cls.__progress(base, sequence, dir_fd)
+
+            if done is None:
+                logger.warning(f" [!] {len(sequence)} rename(s) (@{base}): files have changed "
+                               f"since recorded, skipped")
+                return 0
+
+            for num, (src, dst, _) in enumerate(sequence[done:], done):
+                from_path = os.path.join(base, src)
+                to_path = os.path.join(base, dst)
+
+                # names relative to the directory handle, or paths
+                src_ref, dst_ref = (src, dst) if dir_fd is not None else (from_path, to_path)
+
+                if cls.__taken(src_ref, dst_ref, dir_fd):
+                    logger.warning(f" [!] {dst} <-- {src} (@{base}): target is taken, "
+                                   f"{len(sequence) - num - 1} dependent rename(s) skipped")
+                    break
+
+                if PixTrace.sample():
+                    logger.info(" [A] %s <-- %s (@%s)", dst, src, base)
+
+                started = time.perf_counter()
+
+                try:
+                    os.rename(src_ref, dst_ref, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+                except OSError as e:
+                    logger.error(f"Cannot rename file: {from_path} -> {dst} ({e.strerror}), "
+                                 f"{len(sequence) - num - 1} dependent rename(s) skipped")
+                    break
+
+                if PixMetrics.enabled:
+                    PixMetrics.record("rename", started)
+
+                renamed += 1
+
+                if history is not None:
+                    history.writeline(from_path, to_path)
+
+        return renamed
+
+    @staticmethod
+    def __progress(base, sequence, dir_fd=None) -> int:
+        """
+        Return the number of renames of a sequence done, by matching the
+        files of its names against the states after each rename. Files are
+        told apart by inode numbers. Returns None unless exactly one state
+        matches.
+        """
+        # files at their names before the first rename: name -> inode
+        state = {}
+        moved = set()
+
+        for src, dst, ino in sequence:
+            if src not in moved:
+                state.setdefault(src, ino)
+
+            moved.add(dst)
+
+        names = {x for src, dst, _ in sequence for x in (src, dst)}
+        found = {x: PixMovePlanner.__inode(base, x, dir_fd) for x in names}
+
+        # a case-insensitive file system finds a file under any case of its
+        # name, so names differing in case only are told by the listing
+        if len({x.casefold() for x in names}) < len(names):
+            try:
+                listed = set(os.listdir(dir_fd if dir_fd is not None else base))
+            except OSError:
+                return None
+
+            found = {x: ino if x in listed else None for x, ino in found.items()}
+
+        def matches(state):
+            return all(found[x] == state.get(x) for x in names)
+
+        done = [0] if matches(state) else []
+
+        for num, (src, dst, _) in enumerate(sequence, 1):
+            state[dst] = state.pop(src, None)
+
+            if matches(state):
+                done.append(num)
+
+        return done[0] if len(done) == 1 else None
+
+    @staticmethod
+    def __taken(src_ref, dst_ref, dir_fd=None) -> bool:
+        """
+        Return True if the target of a rename is taken by another file. On a
+        case-insensitive file system, a target differing in case only from
+        the source is found as the source itself, which does not take it.
+        """
+        try:
+            dst_st = os.stat(dst_ref, dir_fd=dir_fd, follow_symlinks=False)
+        except OSError:
+            return False
+
+        if os.path.basename(src_ref).casefold() != os.path.basename(dst_ref).casefold():
+            return True
+
+        try:
+            src_st = os.stat(src_ref, dir_fd=dir_fd, follow_symlinks=False)
+        except OSError:
+            return True
+
+        return (src_st.st_dev, src_st.st_ino) != (dst_st.st_dev, dst_st.st_ino)
+
+    @staticmethod
+    def __inode(base, name, dir_fd=None) -> int:
+        """
+        Return the inode number of a file (not followed if a link), or None
+        """
+        try:
+            st = os.stat(name if dir_fd is not None else os.path.join(base, name),
+                         dir_fd=dir_fd, follow_symlinks=False)
+        except OSError:
+            return None
+
+        return st.st_ino
+
+    @staticmethod
+    def __follow(src, pending, by_dst, sequence) -> list:
+        """
+        Append renames of a chain to a sequence, starting with a given source
+        """
+        while src in pending:
+            sequence.append((src, pending.pop(src)))
+            src = by_dst.get(src)
+
+        return sequence
+
+    @classmethod
+    def __temp_name(cls, names) -> str:
+        """
+        Return a temporary name not taken in a directory
+        """
+        while True:
+            name = "%s%d-%d" % (TEMP_PREFIX, os.getpid(), next(cls.temp_ids))
+
+            if name not in names:
+                names.add(name)
+                return name
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+from threading import Lock as WriteLock
+
+from app.common import ENV
+from app.pixdir import DIR_HANDLES
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+PLAN_VERSION = 1
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixPlan:
+    """
+    Saved renaming plan. It is line-delimited JSON: a header and one line
+    per directory, which lists renames with a fingerprint (size, mtime) of
+    each source file. Sequence numbers are already assigned, so a plan can
+    be applied without scanning and inspecting files again.
+    """
+
+    def __init__(self, plan_path, **options):
+        """
+        Initialization
+        """
+        self.path = plan_path
+        self.file = open(plan_path, "w", encoding="utf-8", errors="surrogateescape")
+        self.lock = WriteLock()
+        self.files = 0
+
+        header = {"plan": PLAN_VERSION, "cwd": os.getcwd(), "created": time.time()}
+        header.update(options)
+
+        self.file.write(json.dumps(header) + "\n")
+
+        logger.info(f"Start to write renaming plan to {self.path}")
+
+    def write(self, base, moves):
+        """
+        Write renames (from name, to name) of a directory. Source files are
+        stat'ed by the calling worker.
+        """
+        renames = []
+
+        with DIR_HANDLES.opened(base) as dir_fd:
+            for x, y in moves:
+                if x == y:
+                    continue
+
+                try:
+                    st = os.stat(x if dir_fd is not None else os.path.join(base, x), dir_fd=dir_fd)
+                except OSError as e:
+                    logger.error(f"Cannot stat file: {os.path.join(base, x)} ({e.strerror})")
+                    continue
+
+                renames.append((x, y, st.st_size, st.st_mtime_ns))
+
+        if renames:
+            line = json.dumps([os.path.abspath(base), renames], ensure_ascii=False, separators=(",", ":"))
+
+            with self.lock:
+                self.file.write(line + "\n")
+                self.files += len(renames)
+
+    def writeline(self, from_path, to_path):
+        """
+        Record a rename done (nothing to do for a plan)
+        """
+        pass
+
+    def close(self):
+        """
+        Close the plan
+        """
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+                logger.info(f"Saved renaming plan of {self.files} file(s) to {self.path}")
+
+    @staticmethod
+    def read(plan_path):
+        """
+        Iterate over (directory, renames) of a plan. Renames are (from name,
+        to name, size, mtime).
+        """
+        with open(plan_path, "r", encoding="utf-8", errors="surrogateescape") as f:
+            header = json.loads(f.readline() or "{}")
+
+            if header.get("plan") != PLAN_VERSION:
+                raise ValueError(f"Not a renaming plan: {plan_path}")
+
+            for line in f:
+                base, renames = json.loads(line)
+                yield base, [tuple(x) for x in renames]
+
+    @staticmethod
+    def validate(base, renames) -> list:
+        """
+        Return renames (from name, to name) whose source file is unchanged
+        since the plan was made
+        """
+        moves = []
+
+        with DIR_HANDLES.opened(base) as dir_fd:
+            for x, y, size, mtime in renames:
+                try:
+                    st = os.stat(x if dir_fd is not None else os.path.join(base, x), dir_fd=dir_fd)
+                except OSError:
+                    logger.warning(f" [!] {y} <-- {x} (@{base}): source is gone, skipped")
+                    continue
+
+                if st.st_size != size or st.st_mtime_ns != mtime:
+                    logger.warning(f" [!] {y} <-- {x} (@{base}): source has changed, skipped")
+                    continue
+
+                moves.append((x, y))
+
+        return moves
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import re
+import logging
+
+from app.common import ENV
+
+
+# ===========================================================
+# GLOBAL VARIABLES
+# ===========================================================
+logger = logging.getLogger(ENV)
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# leading letters of a file name, which tell its source (e.g. IMG, KakaoTalk)
+NAME_PREFIX = re.compile(r"[^\W\d_]*")
+
+# number of groups listed in a summary
+SUMMARY_GROUPS_MAX = 10
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class PixRuleStats:
+    """
+    Hit rates of inspection rules. Files are grouped by directory and file
+    name prefix, and hits and misses of rules are counted per group. Rules
+    are always tried in their order, so results do not depend on it. They
+    are not reordered by hits: metadata rules return right after checking
+    the pix type, so trying the hitting one first saves nothing measurable.
+    """
+    __slots__ = ("names", "groups")
+
+    def __init__(self, names, groups=None):
+        """
+        Initialization. Counts of a group are a list: number of files, then
+        hits and misses of each rule.
+        """
+        self.names = names
+        self.groups = groups if groups is not None else {}
+
+    @staticmethod
+    def key(base, pix_name) -> tuple:
+        """
+        Return the group key of a file: (directory, file name prefix)
+        """
+        return base, NAME_PREFIX.match(pix_name).group().lower()
+
+    def count(self, key) -> list:
+        """
+        Count a file of a group, and return counts of the group. New groups
+        are added.
+        """
+        counts = self.groups.get(key)
+
+        if counts is None:
+            counts = self.groups[key] = [0] * (1 + 2 * len(self.names))
+
+        counts[0] += 1
+
+        return counts
+
+    def hit(self, counts, i):
+        """
+        Count a hit of a rule
+        """
+        counts[1 + i] += 1
+
+    def miss(self, counts, i):
+        """
+        Count a miss of a rule
+        """
+        counts[1 + len(self.names) + i] += 1
+
+    def merge(self, groups):
+        """
+        Add counts of groups, e.g. counted by a worker process
+        """
+        for key, counts in groups.items():
+            group = self.groups.get(key)
+
+            if group is None:
+                self.groups[key] = list(counts)
+            else:
+                group[:] = [x + y for x, y in zip(group, counts)]
+
+    def report(self):
+        """
+        Log hit rates of rules, overall and of the largest groups
+        """
+        totals = [sum(x) for x in zip(*self.groups.values())] or [0] * (1 + 2 * len(self.names))
+
+        logger.info(f"Rule hit rates: {len(self.groups)} group(s) of {totals[0]} file(s)")
+        logger.info(" * all: %s" % self.__rates(totals))
+
+        groups = sorted(self.groups.items(), key=lambda x: x[1][0], reverse=True)
+
+        for (base, prefix), counts in groups[:SUMMARY_GROUPS_MAX]:
+            logger.info(" * %s/%s*: %d file(s), %s" % (
+                base, prefix, counts[0], self.__rates(counts)))
+
+    def __rates(self, counts) -> str:
+        """
+        Return hit rates (hits / tries) of rules
+        """
+        n = len(self.names)
+        rates = []
+
+        for i, name in enumerate(self.names):
+            hits, misses = counts[1 + i], counts[1 + n + i]
+            tries = hits + misses
+
+            rate = "%.0f%% of %d" % (100 * hits / tries, tries) if tries else "-"
+            rates.append("%s %s" % (name, rate))
+
+        return ", ".join(rates)
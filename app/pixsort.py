@@ -1,14 +1,26 @@
 # -*- coding: utf-8 -*-
 import re
+import time
+import sqlite3
 import logging
 import os.path
-import exifread
-from datetime import datetime
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
 
 from app.common import ENV
+from app.pixlog import PixTrace, worker_logging, forward_logging
+from app.pixmetrics import PixMetrics
+from app.pixfile import PixFile
+from app.pixdir import DIR_HANDLES
+from app.pixcache import CACHE_FILE, PixCache
+from app.pixmeta import PixAtomReader, PixChunkReader, PixExifReader
 from app.pixfinder import PixFinder
-from app.pixtype import PX_TYPE, PixTypeMapper
+from app.pixmanifest import MANIFEST_FILE, PixManifest
+from app.pixrules import PixRuleStats
+from app.pixtype import PX_TYPE
 from app.pixwork import PixWorkerGroup
+from app.pixplan import PixPlan
+from app.pixjournal import PixJournal
 from app.pixstamp import STAMP_STYLE, TSINFO_TYPE, PixStamp
 
 
@@ -42,14 +54,237 @@ NAME_PATTERNS = (
     (re.compile(r"(\d{10})\w*\.\w+", re.IGNORECASE), TSINFO_TYPE.EPOCH_SECS),
 )
 
+# rules reading through a memory map: pages touched are not known, so bytes read are not counted
+MMAP_RULES = ("R2", "R4")
+
+# pix types which metadata rules apply to
+RULE_TYPES = {
+    "R2": (PX_TYPE.JPG, PX_TYPE.TIF),
+    "R4": (PX_TYPE.MP4, PX_TYPE.MOV),
+    "R5": (PX_TYPE.PNG,),
+}
+
 
 # ===========================================================
 # CLASS IMPLEMENTATIONS
 # ===========================================================
+class PixInspector:
+    """
+    Timestamp extractor. It applies inspection rules to pix files. Inspectors
+    are plain objects, so they can be shipped to worker processes.
+    """
+    def __init__(self, style=STAMP_STYLE.STANDARD, rule_stats=False):
+        """
+        Initialization. If rule_stats, hits and misses of rules are counted
+        per directory and file name prefix.
+        """
+        self.style = style.fmt
+
+        # worker processes do not share the flag, so it is shipped with the inspector
+        self.metered = PixMetrics.enabled
+
+        self.rule_stats = PixRuleStats(tuple(x for x, _ in self.rules)) if rule_stats else None
+
+    def __getstate__(self) -> dict:
+        """
+        Do not pickle rule counts: worker processes count each batch afresh
+        """
+        stats = self.rule_stats
+        return dict(self.__dict__, rule_stats=PixRuleStats(stats.names) if stats is not None else None)
+
+    def inspect_many(self, pix_paths) -> list:
+        """
+        Inspect pix files and return their pixstamps (or None) in the same
+        order. Pixstamps are created in bulk per timestamp information type.
+        Rules are
+         - a) try to extract from file name
+         - b) if not, try to extract from exif (for JPEG and TIFF)
+         - c) if not, try to extract from movie headers (for MP4 and MOV)
+         - d) if not, try to extract from metadata chunks (for PNG)
+         - e) if not, extract from file stat
+        """
+        stamps = [None] * len(pix_paths)
+        failed = []
+
+        # rows of timestamp information per type: (index, tsi_data, pix_type, desc)
+        tsi_rows = {}
+
+        metered = PixMetrics.enabled
+        stats = self.rule_stats
+
+        for i, (x, dir_fd, pix_name) in enumerate(DIR_HANDLES.relative(pix_paths)):
+            started = time.perf_counter()
+
+            try:
+                with PixFile(x, dir_fd) as px:
+                    counts = stats.count(stats.key(os.path.dirname(x), pix_name)) if stats is not None else None
+                    tsi = self.__inspect_file(px, pix_name, counts)
+
+            except OSError as e:
+                logger.error(f"Cannot open file: {pix_name} ({e.strerror})")
+                continue
+
+            except Exception:
+                logger.exception(f"Cannot inspect file: {pix_name}")
+                continue
+
+            if metered:
+                PixMetrics.record("inspect", started)
+
+            if tsi is None:
+                failed.append(i)
+                continue
+
+            tsi_type, tsi_data, pix_type, desc = tsi
+
+            if not isinstance(tsi_data, tuple):
+                tsi_data = (tsi_data,)
+
+            tsi_rows.setdefault(tsi_type, []).append((i, tsi_data, pix_type, desc))
+
+        for tsi_type, rows in tsi_rows.items():
+            started = time.perf_counter()
+            indexes, tsi_datas, pix_types, descs = zip(*rows)
+            tsi_columns = tuple(zip(*tsi_datas))
+
+            for i, stamp in zip(indexes, PixStamp.new_many(
+                    self.style, tsi_type, tsi_columns, pix_types, descs)):
+                stamps[i] = stamp
+
+                if stamp is None:
+                    failed.append(i)
+
+            if metered:
+                PixMetrics.record("stamp", started, len(rows))
+
+        # failed to extract timestamp information
+        for i in sorted(failed):
+            logger.error(f"Inspection failed: {os.path.split(pix_paths[i])[-1]}")
+
+        return stamps
+
+    def inspect_batch(self, pix_paths) -> tuple:
+        """
+        Inspect a batch of pix files and return compact stamp tuples (or None)
+        in the same order, with metrics recorded meanwhile (or None) and rule
+        counts of the batch (or None). Used by inspection worker processes.
+        """
+        PixMetrics.enabled = self.metered
+
+        stamps = [x.astuple() if x is not None else None for x in self.inspect_many(pix_paths)]
+
+        return (stamps, PixMetrics.take() if self.metered else None,
+                self.rule_stats.groups if self.rule_stats is not None else None)
+
+    def __inspect_file(self, px, pix_name, counts=None) -> tuple:
+        """
+        Apply inspection rules to an opened pix file. Returns timestamp
+        information as (tsi_type, tsi_data, pix_type, desc), or None. Given
+        rule counts of its group, hits and misses of rules are counted.
+        """
+        pix_type = px.type
+
+        if pix_type is PX_TYPE.UNKNOWN:
+            return None
+
+        metered = PixMetrics.enabled
+
+        # high-water mark of the file position: bytes up to it have been read
+        read_pos = len(px.header)
+
+        # extract timestamp information to create pixstamp
+        for i, (desc, rule) in enumerate(self.rules):
+            started = time.perf_counter()
+            tsi = rule(px, pix_name)
+
+            if metered:
+                pos = px.file.tell()
+                nbytes = max(0, pos - read_pos) if desc not in MMAP_RULES else None
+                PixMetrics.record("rule." + desc, started, int(tsi is not None), nbytes)
+                read_pos = max(read_pos, pos)
+
+            if counts is not None:
+                if tsi is not None:
+                    self.rule_stats.hit(counts, i)
+                else:
+                    self.rule_stats.miss(counts, i)
+
+            if tsi is not None:
+                tsi_type, tsi_data = tsi
+                return tsi_type, tsi_data, pix_type, desc
+
+        return None
+
+    @staticmethod
+    def __rule1(px, pix_name) -> tuple:
+        """
+        Rule1: match with file name patterns
+        """
+        for p, tsi_type in NAME_PATTERNS:
+            is_matched = p.match(pix_name)
+            if is_matched:
+                return tsi_type, is_matched.groups()
+
+        return None
+
+    @staticmethod
+    def __rule2(px, pix_name) -> tuple:
+        """
+        Rule2: check exif information (mmap'd, only IFD0 and Exif IFD are read)
+        """
+        if px.type in RULE_TYPES["R2"]:
+            dt_obj = PixExifReader.datetime_original(px.mmap(), px.file)
+            if dt_obj is not None:
+                return TSINFO_TYPE.DATETIME_OBJ, dt_obj
+
+        return None
+
+    @staticmethod
+    def __rule3(px, pix_name) -> tuple:
+        """
+        Rule3: using file stats (taken when the file was opened)
+        """
+        if 0 < px.stat.st_mtime:
+            return TSINFO_TYPE.EPOCH_SECS, int(px.stat.st_mtime)
+
+        return None
+
+    @staticmethod
+    def __rule4(px, pix_name) -> tuple:
+        """
+        Rule4: check creation time in movie headers (mmap'd, payload is not read)
+        """
+        if px.type in RULE_TYPES["R4"]:
+            buf = px.mmap()
+            secs = PixAtomReader.creation_time(buf) if buf is not None else None
+            if secs is not None:
+                return TSINFO_TYPE.EPOCH_SECS, secs
+
+        return None
+
+    @staticmethod
+    def __rule5(px, pix_name) -> tuple:
+        """
+        Rule5: check eXIf and text chunks (image data is not read)
+        """
+        if px.type in RULE_TYPES["R5"]:
+            dt_obj = PixChunkReader.creation_time(px.rewind())
+            if dt_obj is not None:
+                return TSINFO_TYPE.DATETIME_OBJ, dt_obj
+
+        return None
+
+    # inspection rules in the order applied: file stat is the last resort
+    rules = (("R1", __rule1), ("R2", __rule2), ("R4", __rule4), ("R5", __rule5), ("R3", __rule3))
+
+
 class PixSorter:
     """
     Timestamp-based media file sorter
     """
+    # number of files sent to an inspection worker process at once
+    inspect_batch_size = 256
+
     def __init__(self):
         """
         Initialization
@@ -57,9 +292,21 @@ class PixSorter:
         self.opts = {
             'style': STAMP_STYLE.STANDARD,
             'num_workers': 1,
+            'backend': "thread",
+            'concurrency': 64,
+            'scan_workers': 1,
+            'scan_ordered': True,
+            'inspect_workers': 1,
             'recursive': False,
             'uppercase': False,
             'apply': False,
+            'hidden': False,
+            'cache': None,
+            'incremental': None,
+            'rule_stats': False,
+            'stream': False,
+            'bash_history': False,
+            'save_plan': None,
         }
 
         # reaming workers
@@ -81,68 +328,353 @@ class PixSorter:
             return
 
         # Create renaming workers
-        self.workers = PixWorkerGroup(self.opts['num_workers'])
+        self.workers = self.__create_workers()
+
+        # skip what is unchanged since the last run, if incremental
+        manifest = self.__open_manifest(in_dir)
+        self.workers.manifest = manifest
 
         # Scan and process pix files one by one
-        finder = PixFinder()
-        finder.find(in_dir, self.opts['recursive'])
+        finder = PixFinder(hidden=self.opts['hidden'],
+                           num_workers=self.opts['scan_workers'],
+                           ordered=self.opts['scan_ordered'],
+                           manifest=manifest)
+
+        inspector = PixInspector(self.opts['style'], self.opts['rule_stats'])
+        cache = self.__open_cache(in_dir)
+
+        files = finder.find(in_dir, self.opts['recursive'])
+
+        # look up cached stamps first: items are (path, stat, stamp or None)
+        if cache is not None:
+            items = self.__lookup(files, cache)
+        else:
+            items = ((x, None, None) for x in files)
 
         logger.info(f"Inspect pix files in {in_dir}")
 
-        while not finder.empty():
-            x = finder.pop()
+        if 1 < self.opts['inspect_workers']:
+            stamps = self.__inspect_parallel(inspector, items)
+        else:
+            stamps = self.__inspect_serial(inspector, items)
+
+        # in streaming mode, renaming works start while scanning
+        streaming = self.opts['stream']
+
+        if streaming:
+            self.workers.start_streaming(self.opts['uppercase'], self.opts['apply'])
 
-            # inspect each file and create a stamp for it
-            stamp = self.__inspect(x)
+        dir_path = None
+        flushed = set()
+
+        # files per rule (or cached, failed)
+        counts = Counter()
+
+        for x, st, stamp, inspected in stamps:
+            counts["failed" if stamp is None else stamp.desc if inspected else "cached"] += 1
 
             if stamp is not None:
-                logger.info(f" * {stamp} ({stamp.desc}) <-- {os.path.split(x)[-1]}")
+                base = os.path.dirname(x) if streaming else None
+
+                if base != dir_path:
+                    # files of a directory come in a row, so the previous
+                    # directory is complete now: hand it over to workers
+                    if base in flushed:
+                        logger.error(f"Directory already handed over, skipped: {x}")
+                        continue
+
+                    self.workers.flush()
+                    flushed.add(dir_path)
+                    dir_path = base
+
+                if PixTrace.sample():
+                    logger.info(" * %s (%s) <-- %s", stamp, stamp.desc, os.path.basename(x))
+
+                started = time.perf_counter()
                 self.workers.add_work(stamp, x)
 
-        # Start renaming works
-        self.workers.start(self.opts['uppercase'], self.opts['apply'])
+                if PixMetrics.enabled:
+                    PixMetrics.record("group", started)
+
+                if inspected and st is not None and cache is not None:
+                    cache.put(x, st, stamp)
+
+        finder.report()
+
+        if manifest is not None:
+            manifest.report()
+
+        logger.info("Inspected %d file(s): %s", sum(counts.values()),
+                    ", ".join("%s %d" % x for x in sorted(counts.items())) or "none")
+
+        if inspector.rule_stats is not None:
+            inspector.rule_stats.report()
+
+        if cache is not None:
+            # files of unchanged directories are neither looked up nor gone
+            cache.evict(manifest.skipped() if manifest is not None else ())
+            cache.report()
+            cache.close()
+
+        # Start renaming works (or finish streaming ones)
+        if streaming:
+            self.workers.stop_streaming()
+        else:
+            self.workers.start(self.opts['uppercase'], self.opts['apply'])
 
         # clean up
         self.workers.close()
 
+        # the manifest is only moved forward by renames actually done
+        if manifest is not None and self.opts['apply']:
+            manifest.save()
+
         logger.info("Complete")
 
-    def __inspect(self, pix_path) -> str:
+    def apply_plan(self, plan_path):
         """
-        Do pattern matching and extract timestamp information. Rules are
-         - a) try to extract from file name
-         - b) if not, try to extract from exif (for JPEG and TIFF)
-         - c) if not, extract from file stat (for PNG files)
+        Apply a saved renaming plan. Source files are checked against their
+        fingerprints first, and changed or missing ones are skipped.
         """
-        pix_type = PixTypeMapper.map(pix_path)
-        *_, pix_name = os.path.split(pix_path)
+        try:
+            records = list(PixPlan.read(plan_path))
 
-        # extract timestamp information to create pixstamp
-        if pix_type is not PX_TYPE.UNKNOWN:
-            style = self.opts['style'].fmt
-
-            # rule1: match with file name patterns
-            for p, tsi_type in NAME_PATTERNS:
-                is_matched = p.match(pix_name)
-                if is_matched:
-                    return PixStamp.new(style, tsi_type, is_matched.groups(), pix_type, "R1")
-
-            # rule2: check exif information
-            if pix_type in [PX_TYPE.JPG, PX_TYPE.TIF]:
-                exif = exifread.process_file(open(pix_path, "rb"))
-                if "EXIF DateTimeOriginal" in exif.keys():
-                    tsi_type = TSINFO_TYPE.DATETIME_OBJ
-                    dt_obj = datetime.strptime(
-                        exif["EXIF DateTimeOriginal"].values, "%Y:%m:%d %H:%M:%S")
-                    return PixStamp.new(style, tsi_type, dt_obj, pix_type, "R2")
-
-            # rule3: using file stats
-            stat = os.stat(pix_path)
-            if 0 < stat.st_mtime:
-                tsi_type = TSINFO_TYPE.EPOCH_SECS
-                return PixStamp.new(style, tsi_type, int(stat.st_mtime), pix_type, "R3")
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot read renaming plan: {plan_path} ({e})")
+            return
 
-        # failed to extract timestamp information
-        logger.error(f"Inspection failed: {pix_name}")
+        self.workers = self.__create_workers()
 
-        return None
+        logger.info(f"Validate {sum(len(x) for _, x in records)} rename(s) of {plan_path}")
+
+        # stat source files of directories in parallel
+        with ThreadPoolExecutor(self.workers.num_workers) as pool:
+            moves = pool.map(lambda record: PixPlan.validate(*record), records)
+            shards = [(base, x) for (base, _), x in zip(records, moves) if x]
+
+        shards.sort(key=lambda shard: len(shard[1]), reverse=True)
+
+        self.workers.start(False, apply=True, shards=shards)
+        self.workers.close()
+
+        logger.info("Complete")
+
+    def replay(self, journal_path, undo=False):
+        """
+        Undo (or redo) renames recorded in a journal. Directories are replayed
+        in parallel by renaming workers.
+        """
+        try:
+            records = list(PixJournal.read(journal_path))
+
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot read journal: {journal_path} ({e})")
+            return
+
+        logger.info(f"{'Undo' if undo else 'Redo'} {len(records)} rename sequence(s) of {journal_path}")
+
+        shards = {}
+
+        # undo: latest first, and each sequence backwards
+        if undo:
+            records = [(base, [(y, x, ino) for x, y, ino in reversed(sequence)])
+                       for base, sequence in reversed(records)]
+
+        for base, sequence in records:
+            shards.setdefault(base, []).append(sequence)
+
+        self.workers = PixWorkerGroup(self.opts['num_workers'], self.opts['bash_history'])
+        self.workers.start_replay(sorted(shards.items(), key=lambda shard: len(shard[1]), reverse=True),
+                                  self.opts['apply'])
+        self.workers.close()
+
+        logger.info("Complete")
+
+    def __create_workers(self):
+        """
+        Create renaming workers of the selected backend
+        """
+        if self.opts['backend'] == "async":
+            # asyncio is imported only for this backend
+            from app.pixasync import PixAsyncWorkerGroup
+
+            return PixAsyncWorkerGroup(self.opts['concurrency'], self.opts['bash_history'],
+                                       self.opts['save_plan'])
+
+        return PixWorkerGroup(self.opts['num_workers'], self.opts['bash_history'], self.opts['save_plan'])
+
+    def __open_cache(self, in_dir):
+        """
+        Open an inspection cache if enabled. The cache file is placed in the
+        input directory unless a path is given.
+        """
+        cache_path = self.opts.get('cache')
+
+        if not cache_path:
+            return None
+
+        if cache_path is True:
+            cache_path = os.path.join(in_dir, CACHE_FILE)
+
+        try:
+            return PixCache(cache_path)
+
+        except sqlite3.Error as e:
+            logger.error(f"Cannot open inspection cache: {cache_path} ({e})")
+            return None
+
+    def __open_manifest(self, in_dir):
+        """
+        Open a run manifest if incremental. The manifest file is placed in the
+        input directory unless a path is given.
+        """
+        manifest_path = self.opts.get('incremental')
+
+        if not manifest_path:
+            return None
+
+        if manifest_path is True:
+            manifest_path = os.path.join(in_dir, MANIFEST_FILE)
+
+        return PixManifest(manifest_path, in_dir)
+
+    @staticmethod
+    def __lookup(files, cache):
+        """
+        Stat pix files and look up their stamps in the inspection cache
+        """
+        cache_name = os.path.basename(cache.path)
+
+        for x, dir_fd, name in DIR_HANDLES.relative(files):
+            # skip the cache file itself (and its journal files)
+            if name.startswith(cache_name) \
+                    and os.path.abspath(x).startswith(cache.path):
+                continue
+
+            started = time.perf_counter()
+
+            try:
+                st = os.stat(name if dir_fd is not None else x, dir_fd=dir_fd)
+            except OSError:
+                # leave it to inspection, which reports the error
+                yield x, None, None
+                continue
+
+            stamp = cache.get(x, st)
+
+            if PixMetrics.enabled:
+                PixMetrics.record("cache", started, int(stamp is not None))
+
+            yield x, st, stamp
+
+    def __inspect_serial(self, inspector, items):
+        """
+        Inspect pix files which are not cached, batch by batch
+        """
+        for batch in self.__batches(items, self.inspect_batch_size):
+            misses = [x for x, _, stamp in batch if stamp is None]
+            yield from self.__merge_batch(batch, inspector.inspect_many(misses))
+
+    def __inspect_parallel(self, inspector, items):
+        """
+        Inspect pix files on a pool of worker processes. Files are sent in
+        batches, and results are taken in the same order as they were sent.
+        Cached files are not sent.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        num_workers = self.opts['inspect_workers']
+        stats = inspector.rule_stats
+
+        # spawn workers, since forking a process with running threads is unsafe
+        context = multiprocessing.get_context("spawn")
+
+        # spawned workers do not inherit logging: records are handled here
+        records = context.Queue()
+        listener = forward_logging(records)
+
+        pool = ProcessPoolExecutor(num_workers, mp_context=context, initializer=worker_logging,
+                                   initargs=(records, logger.getEffectiveLevel()))
+        running = deque()
+
+        logger.info(f"Start {num_workers} inspection worker(s)")
+
+        try:
+            for batch in self.__batches(items, self.inspect_batch_size):
+                misses = [x for x, _, stamp in batch if stamp is None]
+                future = None
+
+                if misses:
+                    future = pool.submit(inspector.inspect_batch, misses)
+
+                running.append((batch, future))
+
+                # keep a bounded number of batches in flight
+                if num_workers * 2 <= len(running):
+                    yield from self.__take_batch(*running.popleft(), stats)
+
+            while running:
+                yield from self.__take_batch(*running.popleft(), stats)
+
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            listener.stop()
+
+    @staticmethod
+    def __batches(items, batch_size):
+        """
+        Split a stream of items into batches
+        """
+        batch = []
+
+        for x in items:
+            batch.append(x)
+
+            if batch_size <= len(batch):
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    @staticmethod
+    def __take_batch(batch, future, rule_stats=None):
+        """
+        Wait for an inspection batch and merge its stamps with cached ones
+        """
+        stamps = []
+
+        if future is not None:
+            try:
+                results, metrics, rule_counts = future.result()
+
+            except Exception as e:
+                # e.g. a worker process died: files of the batch are failed
+                misses = [x for x, _, stamp in batch if stamp is None]
+                logger.error(f"Cannot inspect a batch of {len(misses)} file(s) from {misses[0]} ({e!r})")
+
+                return PixSorter.__merge_batch(batch, [None] * len(misses))
+
+            stamps = [PixStamp(*t) if t is not None else None for t in results]
+
+            if metrics is not None:
+                PixMetrics.local().merge(metrics)
+
+            if rule_counts is not None:
+                rule_stats.merge(rule_counts)
+
+        return PixSorter.__merge_batch(batch, stamps)
+
+    @staticmethod
+    def __merge_batch(batch, stamps):
+        """
+        Merge inspected stamps with cached ones, in the order of a batch
+        """
+        results = iter(stamps)
+
+        for x, st, stamp in batch:
+            if stamp is not None:
+                yield x, st, stamp, False
+            else:
+                yield x, st, next(results), True
@@ -3,7 +3,7 @@ import logging
 from datetime import datetime
 from enum import Enum
 
-from app.common import ENV
+from app.common import ENV, optional_import
 
 
 # ===========================================================
@@ -44,13 +44,26 @@ class PixStamp:
     """
     Pixstamp for the pix file
     """
-    def __init__(self, fmt, stamp, desc=""):
+    __slots__ = ("fmt", "stamp", "desc", "group_key")
+
+    # number of stamps from which numpy is used for bulk construction
+    numpy_min_rows = 64
+
+    def __init__(self, fmt, stamp, desc="", group_key=None):
         self.fmt = fmt
         self.stamp = stamp
         self.desc = desc
+        self.group_key = group_key if group_key is not None else f"{fmt}/{stamp}"
 
     def __str__(self):
-        return f"{self.fmt}/{self.stamp}"
+        return self.group_key
+
+    def astuple(self):
+        """
+        Return a compact tuple, which can be turned back into a pixstamp
+        with PixStamp(*t)
+        """
+        return (self.fmt, self.stamp, self.desc)
 
     @staticmethod
     def new(style, tsi_type, tsi_data, pix_type, desc="") -> str:
@@ -62,9 +75,12 @@ class PixStamp:
 
         try:
             if TSINFO_TYPE.STANDARD == tsi_type:
+                # build from integers instead of strptime (much faster). Name
+                # patterns guarantee 8 digits for date and 6 digits for time
                 date_s, time_s, usec_s = tsi_data
-                usec_s = (usec_s + "000")[:3]
-                dt = datetime.strptime(f"{date_s}_{time_s}.{usec_s}", "%Y%m%d_%H%M%S.%f")
+                msec = int((usec_s + "000")[:3])
+                dt = datetime(int(date_s[:4]), int(date_s[4:6]), int(date_s[6:8]),
+                              int(time_s[:2]), int(time_s[2:4]), int(time_s[4:6]), msec * 1000)
 
             elif TSINFO_TYPE.TIMESTRUCT == tsi_type:
                 dt = datetime(*list(map(int, tsi_data)))
@@ -93,15 +109,180 @@ class PixStamp:
 
         return None
 
+    @staticmethod
+    def new_many(style, tsi_type, tsi_columns, pix_types, descs) -> list:
+        """
+        Create pixstamp objects for many files at once. Timestamp information
+        is given as columns, e.g. (dates, times, usecs) for STANDARD type.
+        Returns a list of pixstamps (or None for invalid data) in row order.
+
+        Date-time based types in the standard style are validated and
+        formatted in bulk (with numpy if installed), without creating and
+        formatting a datetime object per file. Others are created one by one.
+        """
+        if not pix_types:
+            return []
+
+        if style == STAMP_STYLE.STANDARD.fmt:
+            if TSINFO_TYPE.STANDARD == tsi_type:
+                dates, times, usecs = tsi_columns
+                fields = PixStamp.__standard_fields(dates, times, usecs)
+            elif TSINFO_TYPE.TIMESTRUCT == tsi_type:
+                fields = PixStamp.__timestruct_fields(*tsi_columns)
+            else:
+                fields = None
+
+            if fields is not None:
+                return PixStamp.__new_many_fast(style, tsi_type, tsi_columns, pix_types, descs,
+                                                *fields)
+
+        # create one by one (a single column holds the data itself)
+        rows = zip(*tsi_columns) if 1 < len(tsi_columns) else tsi_columns[0]
+
+        return [PixStamp.new(style, tsi_type, tsi_data, pix_type, desc)
+                for tsi_data, pix_type, desc in zip(rows, pix_types, descs)]
+
+    @staticmethod
+    def __new_many_fast(style, tsi_type, tsi_columns, pix_types, descs, dates, times, msecs):
+        """
+        Bulk construction of standard style stamps from integer columns
+        """
+        stamps = [None] * len(pix_types)
+
+        # years before 1000 are formatted differently by strftime, so they
+        # are left to the one by one construction
+        rows = []
+
+        for i, ymd in enumerate(dates):
+            if ymd < 10000000:
+                tsi_data = tuple(c[i] for c in tsi_columns)
+                stamps[i] = PixStamp.new(style, tsi_type, tsi_data, pix_types[i], descs[i])
+            else:
+                rows.append(i)
+
+        if rows:
+            columns = [[c[i] for i in rows] for c in tsi_columns]
+            args = (columns, [pix_types[i] for i in rows], [descs[i] for i in rows],
+                    [dates[i] for i in rows], [times[i] for i in rows], [msecs[i] for i in rows])
+
+            if PixStamp.numpy_min_rows <= len(rows) and optional_import("numpy") is not None:
+                results = PixStamp.__new_many_numpy(*args)
+            else:
+                results = PixStamp.__new_many_python(*args)
+
+            for i, stamp in zip(rows, results):
+                stamps[i] = stamp
+
+        return stamps
+
+    @staticmethod
+    def __standard_fields(dates, times, usecs) -> tuple:
+        """
+        Return (yyyymmdd, HHMMSS, msec) integer columns for STANDARD type
+        """
+        dates = [int(x) for x in dates]
+        times = [int(x) for x in times]
+        msecs = [int((x + "000")[:3]) for x in usecs]
+
+        return dates, times, msecs
+
+    @staticmethod
+    def __timestruct_fields(years, months, days, hours, minutes, seconds) -> tuple:
+        """
+        Return (yyyymmdd, HHMMSS, msec) integer columns for TIMESTRUCT type
+        """
+        # name patterns guarantee at most 2 digits for fields but year
+        dates = [int(y) * 10000 + int(m) * 100 + int(d) for y, m, d in zip(years, months, days)]
+        times = [int(H) * 10000 + int(M) * 100 + int(S) for H, M, S in zip(hours, minutes, seconds)]
+
+        return dates, times, [0] * len(dates)
+
+    @staticmethod
+    def __new_many_python(tsi_columns, pix_types, descs, dates, times, msecs) -> list:
+        """
+        Bulk construction in pure python
+        """
+        stamps = []
+
+        for i, (ymd, hms, msec) in enumerate(zip(dates, times, msecs)):
+            y, md = divmod(ymd, 10000)
+            H, MS = divmod(hms, 10000)
+
+            try:
+                # validate only, it is much cheaper than formatting
+                datetime(y, md // 100, md % 100, H, MS // 100, MS % 100)
+
+            except ValueError:
+                logger.error(f"Invalid TSI data: {tuple(c[i] for c in tsi_columns)}")
+                stamps.append(None)
+                continue
+
+            pix_type = pix_types[i]
+            stamp_s = "%s_%08d_%06d_%03d" % (pix_type.cls, ymd, hms, msec)
+            stamps.append(PixStamp(pix_type.fmt, stamp_s, descs[i],
+                                   f"{pix_type.fmt}/{stamp_s}"))
+
+        return stamps
+
+    @staticmethod
+    def __new_many_numpy(tsi_columns, pix_types, descs, dates, times, msecs) -> list:
+        """
+        Bulk construction with numpy datetime64 arrays
+        """
+        np = optional_import("numpy")
+
+        ymd = np.asarray(dates, dtype=np.int64)
+        hms = np.asarray(times, dtype=np.int64)
+        msec = np.asarray(msecs, dtype=np.int64)
+
+        y, mo, d = ymd // 10000, ymd // 100 % 100, ymd % 100
+        H, M, S = hms // 10000, hms // 100 % 100, hms % 100
+
+        valid = (1 <= y) & (y <= 9999) & (1 <= mo) & (mo <= 12) & (1 <= d) \
+            & (H < 24) & (M < 60) & (S < 60)
+
+        # number of days in each month, from datetime64 month arithmetic
+        month = ((y - 1970) * 12 + np.clip(mo, 1, 12) - 1).astype("datetime64[M]")
+        mdays = ((month + 1).astype("datetime64[D]") - month.astype("datetime64[D]")).astype(np.int64)
+        valid &= d <= mdays
+
+        # format all stamps and group keys at once
+        cls = np.array([x.cls for x in pix_types])
+        fmt = np.array([x.fmt for x in pix_types])
+
+        stamps = np.char.add(np.char.add(cls, "_"), np.char.add(
+            np.char.zfill(ymd.astype(str), 8), np.char.add(
+                np.char.add("_", np.char.zfill(hms.astype(str), 6)),
+                np.char.add("_", np.char.zfill(msec.astype(str), 3)))))
+        keys = np.char.add(np.char.add(fmt, "/"), stamps)
+
+        results = []
+
+        for i, (ok, fmt_s, stamp_s, key_s) in enumerate(zip(valid.tolist(), fmt.tolist(),
+                                                            stamps.tolist(), keys.tolist())):
+            if ok:
+                results.append(PixStamp(fmt_s, stamp_s, descs[i], key_s))
+            else:
+                logger.error(f"Invalid TSI data: {tuple(c[i] for c in tsi_columns)}")
+                results.append(None)
+
+        return results
+
 
 class PixStampGroup:
     """
     Pix stamp group
     """
-    def __init__(self, fmt, stamp, path=None):
+    __slots__ = ("fmt", "stamp", "paths")
+
+    def __init__(self, fmt, stamp, path=None, paths=None):
         self.fmt = fmt
         self.stamp = stamp
-        self.paths = [path,] if path else []
+
+        if paths is not None:
+            self.paths = paths
+        else:
+            self.paths = [path,] if path else []
 
     def key(self):
         """
@@ -2,9 +2,8 @@
 import logging
 from enum import Enum
 from dataclasses import dataclass
-from PIL import Image, UnidentifiedImageError
 
-from app.common import ENV
+from app.common import ENV, optional_import
 
 
 # ===========================================================
@@ -13,6 +12,20 @@ from app.common import ENV
 logger = logging.getLogger(ENV)
 
 
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# number of leading bytes needed to sniff a file type
+SNIFF_SIZE = 32
+
+# ISO base media file format brands (ftyp box) of MP4 and QuickTime movies
+MOV_BRANDS = (b"qt  ",)
+MP4_BRANDS = (b"isom", b"iso2", b"iso4", b"iso5", b"iso6", b"mp41", b"mp42", b"avc1")
+
+# movie types, told apart by file extensions as brands are shared by both
+MOVIE_TYPES = ("mp4", "mov")
+
+
 # ==========================================================
 # DATA TYPES
 # ==========================================================
@@ -63,18 +76,47 @@ class PixTypeMapper:
         raise RuntimeError('%s should not be instantiated' % cls)
 
     @classmethod
-    def map(cls, pix_path) -> object:
+    def sniff(cls, header, pix_path) -> object:
         """
-        Map a given file to media type object
+        Map leading bytes of a file to media type object. Returns None if
+        the type cannot be decided from them. MP4 and QuickTime movies are
+        recognized by their brands, and then mapped by their extensions.
         """
-        try:
-            fmt = Image.open(pix_path).format.lower()
+        if header[:3] == b"\xff\xd8\xff":
+            return PX_TYPE.JPG
+
+        if header[:4] in (b"II*\x00", b"MM\x00*"):
+            return PX_TYPE.TIF
 
-        except UnidentifiedImageError:
+        if header[:8] == b"\x89PNG\r\n\x1a\n":
+            return PX_TYPE.PNG
+
+        if header[4:8] == b"ftyp" and header[8:12] in MOV_BRANDS + MP4_BRANDS:
             *_, fmt = pix_path.lower().split(".")
 
-        except FileNotFoundError:
-            logger.error(f"File not found: {pix_path}")
-            return PX_TYPE.UNKNOWN
+            if fmt in MOVIE_TYPES:
+                return cls.type_map[fmt]
+
+        return None
+
+    @classmethod
+    def guess(cls, pix_path) -> object:
+        """
+        Map a given file to media type object using PIL or its extension.
+        PIL is imported here, only for files whose magic bytes are unknown.
+        """
+        fmt = None
+        Image = optional_import("PIL.Image")
+
+        if Image is not None:
+            try:
+                with Image.open(pix_path) as im:
+                    fmt = im.format.lower()
+
+            except (Image.UnidentifiedImageError, OSError):
+                pass
+
+        if fmt is None:
+            *_, fmt = pix_path.lower().split(".")
 
         return cls.type_map[fmt] if (fmt in cls.type_map) else PX_TYPE.UNKNOWN
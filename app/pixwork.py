@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
-import os.path
+import os
+import re
+import time
 import logging
+from array import array
+from queue import Queue, Full
 from threading import Thread
 from collections import deque
 
 from app.common import ENV
+from app.pixlog import PixTrace, emit_lines
 from app.pixstamp import PixStampGroup
-from app.pixhistory import PixHistory
+from app.pixdir import DIR_HANDLES
+from app.pixmove import PixMovePlanner
+from app.pixplan import PixPlan
+from app.pixjournal import PixJournal
 
 
 # ===========================================================
@@ -15,30 +23,183 @@ from app.pixhistory import PixHistory
 logger = logging.getLogger(ENV)
 
 
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+# group key of the standard stamp style, which can be interned as an integer
+STANDARD_KEY = re.compile(r"([^/]+)/([^/_]+)_(\d{8})_(\d{6})_(\d{3})", re.ASCII)
+
+
 # ===========================================================
 # CLASS IMPLEMENTATIONS
 # ===========================================================
-class PixWorkQueue:
+class PixDirTable:
     """
-    Simple queue with index
+    Shared directory table. Each directory path is stored once and files
+    refer to it by id.
     """
-    def __init__(self, index=None):
+    __slots__ = ("ids", "paths")
+
+    def __init__(self):
         """
         Initialization
         """
-        self.queue = deque()
-        self.count = 0
+        self.ids = {}
+        self.paths = []
 
-        if index is not None:
-            self.index = index
-        else:
-            self.index = {}
+    def __len__(self):
+        return len(self.paths)
+
+    def intern(self, dir_path) -> int:
+        """
+        Return the id of a given directory path. New paths are added.
+        """
+        dir_id = self.ids.get(dir_path)
+
+        if dir_id is None:
+            dir_id = self.ids[dir_path] = len(self.paths)
+            self.paths.append(dir_path)
+
+        return dir_id
+
+    def path(self, dir_id) -> str:
+        """
+        Return the path of a given directory id
+        """
+        return self.paths[dir_id]
+
+
+class PixWorkPlan:
+    """
+    Compact store of renaming works. Files are kept in columns as (directory
+    id, base name) pairs, and each pixstamp group is a linked list of files
+    identified by an integer group id. Group keys of the standard stamp style
+    are interned as integers.
+    """
+    __slots__ = ("dirs", "prefixes", "index", "keys", "heads",
+                 "file_dirs", "file_names", "file_next")
+
+    def __init__(self):
+        """
+        Initialization
+        """
+        self.dirs = PixDirTable()
+
+        # (fmt, cls) prefixes of integer group keys
+        self.prefixes = {}
+
+        # group key -> group id, and group columns
+        self.index = {}
+        self.keys = []
+        self.heads = array("i")
+
+        # file columns
+        self.file_dirs = array("I")
+        self.file_names = []
+        self.file_next = array("i")
+
+    def __len__(self):
+        return len(self.keys)
 
-    def __del__(self):
+    def size(self) -> int:
         """
-        Clean-up
+        Return the number of files
         """
-        self.queue.clear()
+        return len(self.file_names)
+
+    def add(self, group_key, path) -> tuple:
+        """
+        Add a file to a pixstamp group. Returns (group id, True if the group is new)
+        """
+        key = self.__encode(group_key)
+        gid = self.index.get(key)
+        is_new = gid is None
+
+        if is_new:
+            gid = self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.heads.append(-1)
+
+        base, name = os.path.split(path)
+
+        # prepend the file to the group (paths are sorted when taken)
+        self.file_dirs.append(self.dirs.intern(base))
+        self.file_names.append(name)
+        self.file_next.append(self.heads[gid])
+        self.heads[gid] = len(self.file_names) - 1
+
+        return gid, is_new
+
+    def paths(self, gid) -> list:
+        """
+        Return file paths of a given group
+        """
+        paths = []
+        i = self.heads[gid]
+
+        while 0 <= i:
+            paths.append(os.path.join(self.dirs.path(self.file_dirs[i]), self.file_names[i]))
+            i = self.file_next[i]
+
+        return paths
+
+    def group(self, gid) -> object:
+        """
+        Return a pixstamp group object of a given group id
+        """
+        fmt, _, stamp = self.key(gid).partition("/")
+
+        return PixStampGroup(fmt, stamp, paths=self.paths(gid))
+
+    def key(self, gid) -> str:
+        """
+        Return the group key string of a given group id
+        """
+        key = self.keys[gid]
+
+        if isinstance(key, str):
+            return key
+
+        # integer key: prefix, date, time and milliseconds
+        prefix, ymd, hms, msec = key // 10 ** 17, key // 10 ** 9 % 10 ** 8, key // 1000 % 10 ** 6, key % 1000
+
+        for (fmt, cls), prefix_id in self.prefixes.items():
+            if prefix_id == prefix:
+                return "%s/%s_%08d_%06d_%03d" % (fmt, cls, ymd, hms, msec)
+
+    def __encode(self, group_key) -> object:
+        """
+        Intern a group key as an integer if it is of the standard stamp style
+        (fmt/cls_yyyymmdd_HHMMSS_fff). Other keys are kept as strings.
+        """
+        m = STANDARD_KEY.fullmatch(group_key)
+
+        if m is None:
+            return group_key
+
+        fmt, cls, ymd, hms, msec = m.groups()
+        prefix = self.prefixes.setdefault((fmt, cls), len(self.prefixes))
+
+        return ((prefix * 10 ** 8 + int(ymd)) * 10 ** 6 + int(hms)) * 1000 + int(msec)
+
+
+class PixWorkQueue:
+    """
+    Work-stealing queue of shards. A shard is a directory and the renames
+    (from name, to name) planned in it. The owner takes shards from the
+    front, and idle workers steal them from the back. Deque operations are
+    atomic, so no lock is needed.
+    """
+    __slots__ = ("queue",)
+
+    def __init__(self):
+        """
+        Initialization
+        """
+        self.queue = deque()
+
+    def __len__(self):
+        return len(self.queue)
 
     def empty(self):
         """
@@ -46,88 +207,174 @@ class PixWorkQueue:
         """
         return True if (not self.queue) else False
 
-    def push(self, elem):
+    def push(self, shard):
         """
-        Push an element with index key.
+        Push a shard
         """
-        self.queue.append(elem)
-        self.count += 1
-
-        self.index[elem.key()] = elem
+        self.queue.append(shard)
 
     def pop(self):
         """
-        Pop one element. Also update index.
+        Pop a shard from the front (owner side), or None if empty
+        """
+        try:
+            return self.queue.popleft()
+        except IndexError:
+            return None
+
+    def steal(self):
+        """
+        Pop a shard from the back (thief side), or None if empty
         """
-        elem = None
+        try:
+            return self.queue.pop()
+        except IndexError:
+            return None
+
 
-        if self.queue:
-            elem = self.queue.popleft()
-            self.index.pop(elem.key())
+class PixWorkerStats:
+    """
+    Renaming statistics of a worker
+    """
+    __slots__ = ("tid", "files", "renamed", "unchanged", "blocked", "shards", "stolen", "elapsed")
 
-        return elem
+    def __init__(self, tid):
+        self.tid = tid
+        self.files = 0
+        self.renamed = 0
+        self.unchanged = 0
+        self.blocked = 0
+        self.shards = 0
+        self.stolen = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        rate = self.files / self.elapsed if 0 < self.elapsed else 0.0
+
+        return "worker %2d: %8d file(s), %8d renamed, %6d shard(s) (%d stolen) in %.3fs, %.1f files/s" % (
+            self.tid, self.files, self.renamed, self.shards, self.stolen, self.elapsed, rate)
 
 
 class PixWorkerGroup:
     """
-    Group of renaming workers.
+    Group of renaming workers. Works are sharded by directory, so renames in
+    a directory are planned and done by one worker without collisions, and
+    shards are handed out dynamically.
     """
-    worker_count_max = 8
+    worker_count_max = 256
+
+    # number of directory shards waiting for streaming workers
+    stream_depth = 256
 
-    def __init__(self, num_workers=1):
+    # seconds to wait for room in the stream, before checking workers are alive
+    stream_timeout = 1.0
+
+    def __init__(self, num_workers=1, bash_history=False, save_plan=None):
         """
         Initialization
         """
-        self.index = {}
+        self.bash_history = bash_history
+        self.save_plan = save_plan
+        self.plan = PixWorkPlan()
+        self.index = self.plan.index
         self.workq = []
-        self.count = 0
+        self.stats = []
         self.history = None
+        self.uppercase = False
 
-        # create work queues and put them into a set
-        if 0 < num_workers <= self.worker_count_max:
+        # manifest of an incremental run, which reserves names of stamped files
+        self.manifest = None
+
+        # streaming mode
+        self.stream = None
+        self.threads = []
+
+        # size the pool: renaming is I/O bound, so use more workers than CPUs
+        if num_workers <= 0:
+            self.num_workers = min(32, (os.cpu_count() or 1) + 4)
+        elif num_workers <= self.worker_count_max:
             self.num_workers = num_workers
         else:
-            self.num_workers = 1
+            logger.warning(f"Too many workers: {num_workers} (use {self.worker_count_max})")
+            self.num_workers = self.worker_count_max
 
+        # create work queues and put them into a set
         for i in range(self.num_workers):
-            self.workq.append(PixWorkQueue(index=self.index))
+            self.workq.append(PixWorkQueue())
+            self.stats.append(PixWorkerStats(i))
 
-    def add_work(self, pixstamp, path) -> object:
+    def add_work(self, pixstamp, path) -> int:
         """
         Create a renaming work for a given pixstamp. If duplicated, they are merged.
+        Returns the group id.
+        """
+        gid, _ = self.plan.add(pixstamp.group_key, path)
+
+        return gid
+
+    def shards(self, uppercase=False) -> list:
         """
-        key = f"{pixstamp.fmt}/{pixstamp.stamp}"
+        Assign sequence numbers in each pixstamp group, and split the renames
+        into shards by directory. Returns (directory, renames) pairs, largest
+        first. In an incremental run, names of stamped files which are kept
+        in a directory are not assigned again.
+        """
+        shards = {}
+        taken = {}
+
+        for gid in range(len(self.plan)):
+            psg = self.plan.group(gid)
+            psg.sort_paths()
+            seq = 0
+
+            for from_path in psg.paths:
+                base, x = os.path.split(from_path)
+                y = "%s%03d.%s" % (psg.stamp, seq, psg.fmt)
+                seq += 1
+
+                if uppercase:
+                    y = y.upper()
 
-        if key not in self.index:
-            # create a new pixstamp group
-            next_queue = self.workq[self.count % self.num_workers]
-            next_queue.push(PixStampGroup(pixstamp.fmt, pixstamp.stamp))
-            self.count += 1
+                if self.manifest is not None:
+                    if base not in taken:
+                        taken[base] = self.manifest.taken(base)
 
-        # append a path to pixstamp group
-        psg = self.index[key]
-        psg.add_path(path)
+                    while y in taken[base]:
+                        y = "%s%03d.%s" % (psg.stamp, seq, psg.fmt)
+                        seq += 1
 
-        return psg
+                        if uppercase:
+                            y = y.upper()
 
-    def start(self, uppercase, apply=False):
+                shards.setdefault(base, []).append((x, y))
+
+        if self.manifest is not None:
+            for base, moves in shards.items():
+                self.manifest.plan(base, moves)
+
+        return sorted(shards.items(), key=lambda shard: len(shard[1]), reverse=True)
+
+    def start(self, uppercase, apply=False, shards=None):
         """
-        Start renaming workers. Each worker processes its own work queue.
+        Start renaming workers. Directory shards are dealt to workers, and
+        workers steal shards from each other when their own queue is empty.
+        Shards of a saved plan can be given instead of added works.
         """
-        # set operation mode
-        if apply:
-            logger.info(f"Start {self.num_workers} worker(s) in apply mode with history logging")
-            target = PixWorkerGroup.__process
-            self.history = PixHistory(".")
-        else:
-            logger.info(f"Start {self.num_workers} worker(s) in preview mode")
-            target = PixWorkerGroup.__preview
+        target = self.__prepare(uppercase, apply)
+
+        if shards is None:
+            shards = self.shards(self.uppercase)
+
+        # deal shards, largest first, to balance initial queues
+        for i, shard in enumerate(shards):
+            self.workq[i % self.num_workers].push(shard)
 
         # create wrokers
         workers = []
 
         for i in range(self.num_workers):
-            worker = Thread(target=target, args=(i, self.workq[i], self.history, uppercase))
+            shards = PixWorkerGroup.__queued_shards(i, self.workq, self.stats[i])
+            worker = Thread(target=target, args=(i, shards, self.history, self.stats[i]))
             workers.append(worker)
 
             # start a worker as thread
@@ -136,6 +383,118 @@ class PixWorkerGroup:
         for worker in workers:
             worker.join()
 
+        self.report()
+
+    def start_replay(self, shards, apply=False):
+        """
+        Start workers replaying recorded rename sequences. Shards are
+        (directory, sequences) pairs.
+        """
+        target = self.__prepare(False, apply, PixWorkerGroup.__replay)
+
+        for i, shard in enumerate(shards):
+            self.workq[i % self.num_workers].push(shard)
+
+        workers = []
+
+        for i in range(self.num_workers):
+            shards = PixWorkerGroup.__queued_shards(i, self.workq, self.stats[i])
+            worker = Thread(target=target, args=(i, shards, self.history, self.stats[i]))
+            workers.append(worker)
+
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        self.report()
+
+    def start_streaming(self, uppercase, apply=False):
+        """
+        Start renaming workers in streaming mode. Works are added directory by
+        directory, and each directory is handed over to workers by flush().
+        """
+        target = self.__prepare(uppercase, apply)
+
+        self.stream = Queue(maxsize=self.stream_depth)
+
+        for i in range(self.num_workers):
+            shards = PixWorkerGroup.__streamed_shards(self.stream, self.stats[i])
+            worker = Thread(target=target, args=(i, shards, self.history, self.stats[i]))
+            self.threads.append(worker)
+
+            # start a worker as thread
+            worker.start()
+
+    def flush(self):
+        """
+        Hand over all works added so far to streaming workers, as directory
+        shards. It blocks while the stream is full, which holds back scanning
+        and inspection.
+        """
+        for shard in self.shards(self.uppercase):
+            if not self.__put(shard):
+                logger.error(f"Renaming workers have stopped, not renamed: {shard[0]}")
+
+        self.plan = PixWorkPlan()
+        self.index = self.plan.index
+
+    def stop_streaming(self):
+        """
+        Hand over remaining works and wait for streaming workers to finish
+        """
+        self.flush()
+
+        for _ in self.threads:
+            self.__put(None)
+
+        for worker in self.threads:
+            worker.join()
+
+        self.threads = []
+        self.report()
+
+    def report(self):
+        """
+        Log renaming throughput of each worker
+        """
+        elapsed = max((x.elapsed for x in self.stats), default=0.0)
+        files = sum(x.files for x in self.stats)
+
+        logger.info(f"Renaming works: {files} file(s) by {self.num_workers} worker(s): "
+                    f"{sum(x.renamed for x in self.stats)} renamed, "
+                    f"{sum(x.unchanged for x in self.stats)} unchanged, "
+                    f"{sum(x.blocked for x in self.stats)} blocked")
+
+        for x in self.stats:
+            if x.shards:
+                logger.info(f" * {x}")
+
+        if 0 < elapsed:
+            logger.info(f"Renaming throughput: {files / elapsed:.1f} files/s")
+
+        DIR_HANDLES.report()
+
+    @staticmethod
+    def preview_lines(base, moves, blocked, stats) -> list:
+        """
+        Return preview lines of renames in a directory
+        """
+        blocked = set(blocked)
+        lines = []
+
+        for x, y in moves:
+            # compare old(x) and new(y) file names
+            if x == y:
+                stats.unchanged += 1
+                lines.append(" [X] %-30s <-- %s (@%s)" % ("---", x, base))
+            elif (x, y) in blocked:
+                lines.append(f" [!] {y} <-- {x} (@{base}): target is taken, not renamed")
+            else:
+                lines.append(f" [P] {y} <-- {x} (@{base})")
+
+        return lines
+
     def close(self):
         """
         Clean up resources
@@ -143,62 +502,180 @@ class PixWorkerGroup:
         if self.history:
             self.history.close()
 
+        DIR_HANDLES.close()
+
+    def __put(self, item) -> bool:
+        """
+        Put an item into the stream. Returns False if all streaming workers
+        have stopped, since nobody would take it.
+        """
+        while True:
+            try:
+                self.stream.put(item, timeout=self.stream_timeout)
+                return True
+
+            except Full:
+                if not any(x.is_alive() for x in self.threads):
+                    return False
+
+    def __prepare(self, uppercase, apply, process=None):
+        """
+        Set operation mode and return the worker function
+        """
+        self.uppercase = uppercase
+
+        if apply:
+            logger.info(f"Start {self.num_workers} worker(s) in apply mode with history logging")
+            self.history = PixJournal(".", bash=self.bash_history)
+            return process or PixWorkerGroup.__process
+
+        logger.info(f"Start {self.num_workers} worker(s) in preview mode")
+
+        if process:
+            return PixWorkerGroup.__show_replay
+
+        if self.save_plan:
+            self.history = PixPlan(self.save_plan, uppercase=uppercase)
+
+        return PixWorkerGroup.__preview
+
     @staticmethod
-    def __process(tid, queue, history, uppercase):
+    def __queued_shards(tid, workq, stats):
         """
-        Do renaming works
+        Iterate over shards in the own work queue, then over shards stolen
+        from other work queues
         """
-        while not queue.empty():
-            psg = queue.pop()
-            psg.sort_paths()
-            seq = 0
+        while True:
+            shard = workq[tid].pop()
 
-            for from_path in psg.paths:
-                base, x = os.path.split(from_path)
-                y = "%s%03d.%s" % (psg.stamp, seq, psg.fmt)
-                seq += 1
+            if shard is None:
+                # steal from the others, starting with the next worker
+                for i in range(1, len(workq)):
+                    shard = workq[(tid + i) % len(workq)].steal()
 
-                if uppercase:
-                    y = y.upper()
+                    if shard is not None:
+                        stats.stolen += 1
+                        break
+
+            if shard is None:
+                break
 
-                # compare old(x) and new(y) file names
-                if x == y:
-                    logger.info(" [X] %-30s <-- %s (@%s)" % ("---", x, base))
-                else:
-                    # rename pix file and write history
-                    logger.info(f" [A] {y} <-- {x} (@{base})")
+            stats.shards += 1
+            yield shard
+
+    @staticmethod
+    def __streamed_shards(stream, stats):
+        """
+        Iterate over shards handed over through a stream, until None
+        """
+        while True:
+            shard = stream.get()
 
-                    to_path = os.path.join(base, y)
-                    os.rename(from_path, to_path)
+            if shard is None:
+                break
 
-                    history.writeline(from_path, to_path)
+            stats.shards += 1
+            yield shard
 
     @staticmethod
-    def __preview(tid, queue, history, uppercase):
+    def __process(tid, shards, history, stats):
         """
-        Preview renaming works. (not applied)
+        Do renaming works. Renames of a directory are planned first, so that
+        no file is overwritten.
         """
-        while not queue.empty():
-            psg = queue.pop()
-            psg.sort_paths()
-            seq = 0
+        started = time.perf_counter()
 
-            for from_path in psg.paths:
-                base, x = os.path.split(from_path)
-                y = "%s%03d.%s" % (psg.stamp, seq, psg.fmt)
-                seq += 1
+        for base, moves in shards:
+            try:
+                stats.files += len(moves)
 
-                if uppercase:
-                    y = y.upper()
+                for x, y in moves:
+                    if x == y:
+                        stats.unchanged += 1
+
+                        if PixTrace.sample():
+                            logger.info(" [X] %-30s <-- %s (@%s)", "---", x, base)
+
+                sequences, blocked = PixMovePlanner.plan(base, [(x, y) for x, y in moves if x != y])
+                stats.blocked += len(blocked)
+
+                for x, y in blocked:
+                    logger.error(" [!] %s <-- %s (@%s): target is taken, not renamed", y, x, base)
+
+                # write ahead of renaming
+                history.write(base, sequences)
+
+                for sequence in sequences:
+                    stats.renamed += PixMovePlanner.execute(base, sequence, history)
+
+            except Exception:
+                # a worker goes on with other shards, so streaming never blocks
+                logger.exception(f"Renaming works failed in a directory: {base}")
+
+        stats.elapsed += time.perf_counter() - started
+
+    @staticmethod
+    def __preview(tid, shards, history, stats):
+        """
+        Preview renaming works (not applied), and save them if a plan is given
+        """
+        started = time.perf_counter()
+
+        for base, moves in shards:
+            try:
+                stats.files += len(moves)
+
+                if history is not None:
+                    history.write(base, moves)
+
+                _, blocked = PixMovePlanner.plan(base, [(x, y) for x, y in moves if x != y])
+                stats.blocked += len(blocked)
+
+                emit_lines(PixWorkerGroup.preview_lines(base, moves, blocked, stats))
+
+            except Exception:
+                logger.exception(f"Renaming works failed in a directory: {base}")
+
+        stats.elapsed += time.perf_counter() - started
+
+    @staticmethod
+    def __replay(tid, shards, history, stats):
+        """
+        Replay recorded rename sequences
+        """
+        started = time.perf_counter()
+
+        for base, sequences in shards:
+            try:
+                history.write(base, sequences)
+
+                for sequence in sequences:
+                    stats.files += len(sequence)
+                    stats.renamed += PixMovePlanner.replay(base, sequence, history)
+
+            except Exception:
+                logger.exception(f"Renaming works failed in a directory: {base}")
+
+        stats.elapsed += time.perf_counter() - started
+
+    @staticmethod
+    def __show_replay(tid, shards, history, stats):
+        """
+        Preview replaying recorded rename sequences. (not applied)
+        """
+        started = time.perf_counter()
+
+        for base, sequences in shards:
+            try:
+                lines = []
+
+                for sequence in sequences:
+                    stats.files += len(sequence)
+                    lines.extend(f" [P] {y} <-- {x} (@{base})" for x, y, _ in sequence)
+
+                emit_lines(lines)
+
+            except Exception:
+                logger.exception(f"Renaming works failed in a directory: {base}")
 
-                # compare old(x) and new(y) file names
-                if x == y:
-                    if ENV == "prd":
-                        logger.info(" [X] %-30s <-- %s (@%s)" % ("---", x, base))
-                    else:
-                        print(" [X] %-30s <-- %s (@%s)" % ("---", x, base))
-                else:
-                    if ENV == "prd":
-                        logger.info(f" [P] {y} <-- {x} (@{base})")
-                    else:
-                        print(f" [P] {y} <-- {x} (@{base})")
+        stats.elapsed += time.perf_counter() - started
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of a whole run (PixSorter.run) on a synthetic photo
+archive. The archive is generated on tmpfs (/dev/shm if present) with file
+names of every name pattern and files which need metadata: minimal JPEGs
+and TIFFs with EXIF, PNGs with text and eXIf chunks, and MP4s with a mvhd
+atom. Each phase is timed in preview and apply modes, and the results are
+stored as JSON for comparison between versions.
+
+    python3 bench/bench_archive.py [-n NUM_FILES] [-l {wide,deep,flat}] [-m {preview,apply,both}]
+    python3 bench/bench_archive.py --compare OLD.json NEW.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import struct
+import logging
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.common import ENV                                          # noqa: E402
+from app.pixsort import PixSorter                                   # noqa: E402
+from app.pixmetrics import PixMetrics                               # noqa: E402
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# QuickTime epoch (1904) to UNIX epoch
+QT_EPOCH_OFFSET = 2082844800
+
+# kinds of sample files and their weights: (kind, extension, weight)
+SAMPLE_KINDS = (
+    ("standard", "jpg", 20),        # IMG_20200101_120000_123.jpg
+    ("datetime", "jpg", 20),        # 20200101_120000.jpg
+    ("datetime_sep", "jpg", 5),     # 20200101_120000 (1).jpg
+    ("timestruct", "png", 5),       # Screenshot 2020-01-01 at 12.00.00.png
+    ("epoch", "jpg", 10),           # 1577880000123.jpg
+    ("exif", "jpg", 20),            # DSC_0001.jpg with DateTimeOriginal
+    ("exif", "tif", 3),             # SCAN_0001.tif with DateTimeOriginal
+    ("png_text", "png", 5),         # image_0001.png with Creation Time
+    ("png_exif", "png", 2),         # image_0001.png with eXIf
+    ("mvhd", "mp4", 7),             # VID_0001.mp4 with mvhd
+    ("stat", "jpg", 3),             # photo_0001.jpg without metadata
+)
+
+# phases reported, from per-stage metrics
+PHASES = ("scan", "opendir", "open", "type", "rule.R1", "rule.R2", "rule.R3", "rule.R4", "rule.R5",
+          "inspect", "stamp", "group", "plan", "rename", "journal")
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def exif_tiff(dt, order=b"MM"):
+    """
+    Build a TIFF header with IFD0 -> Exif IFD -> DateTimeOriginal
+    """
+    e = ">" if order == b"MM" else "<"
+    value = dt.encode() + b"\0"
+
+    ifd0 = struct.pack(e + "H", 1) + struct.pack(e + "HHII", 0x8769, 4, 1, 26) + struct.pack(e + "I", 0)
+    exif = struct.pack(e + "H", 1) + struct.pack(e + "HHII", 0x9003, 2, len(value), 44) + struct.pack(e + "I", 0)
+
+    return order + struct.pack(e + "HI", 42, 8) + ifd0 + exif + value
+
+
+def make_jpeg(dt=None, padding=0):
+    """
+    Build a minimal JPEG, with an EXIF segment if a timestamp is given
+    """
+    data = b"\xff\xd8"
+
+    if dt is not None:
+        app1 = b"Exif\0\0" + exif_tiff(dt)
+        data += b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1
+
+    # image data is never read by rules, so a comment segment stands in for it
+    if padding:
+        data += b"\xff\xfe" + struct.pack(">H", min(padding, 65533) + 2) + b"\0" * min(padding, 65533)
+
+    return data + b"\xff\xd9"
+
+
+def make_tiff(dt, padding=0):
+    """
+    Build a minimal TIFF with DateTimeOriginal
+    """
+    return exif_tiff(dt, b"II") + b"\0" * padding
+
+
+def png_chunk(kind, data):
+    """
+    Build a PNG chunk
+    """
+    import zlib
+
+    return struct.pack(">I4s", len(data), kind) + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def make_png(text=None, dt=None, padding=0):
+    """
+    Build a minimal PNG, with a Creation Time text chunk or an eXIf chunk
+    """
+    import zlib
+
+    data = b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))
+
+    if text is not None:
+        data += png_chunk(b"tEXt", b"Creation Time\0" + text.encode())
+
+    if dt is not None:
+        data += png_chunk(b"eXIf", exif_tiff(dt))
+
+    data += png_chunk(b"IDAT", zlib.compress(b"\0\0" + b"\0" * padding))
+
+    return data + png_chunk(b"IEND", b"")
+
+
+def make_mp4(secs, padding=0):
+    """
+    Build a minimal MP4: ftyp, mdat and moov with a mvhd atom
+    """
+    def box(kind, payload):
+        return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+    ct = secs + QT_EPOCH_OFFSET
+    mvhd = box(b"mvhd", b"\0\0\0\0" + struct.pack(">II", ct, ct) + b"\0" * 88)
+
+    return box(b"ftyp", b"isom\0\0\0\0isom") + box(b"mdat", b"\0" * padding) + box(b"moov", mvhd)
+
+
+def make_sample(kind, ext, ts, i, padding):
+    """
+    Return (file name, content) of a sample file of a given kind
+    """
+    t = time.gmtime(ts)
+    ymd = time.strftime("%Y%m%d", t)
+    hms = time.strftime("%H%M%S", t)
+    exif_dt = time.strftime("%Y:%m:%d %H:%M:%S", t)
+
+    if kind == "standard":
+        return "IMG_%s_%s_%03d.%s" % (ymd, hms, i % 1000, ext), make_jpeg(padding=padding)
+    if kind == "datetime":
+        return "%s_%s.%s" % (ymd, hms, ext), make_jpeg(padding=padding)
+    if kind == "datetime_sep":
+        return "%s_%s (%d).%s" % (ymd, hms, i, ext), make_jpeg(padding=padding)
+    if kind == "timestruct":
+        return "Screenshot %s at %d.%s.%s.%s" % (time.strftime("%Y-%m-%d", t), t.tm_hour,
+                                                 time.strftime("%M", t), time.strftime("%S", t),
+                                                 ext), make_png(padding=padding)
+    if kind == "epoch":
+        return "%d%03d.%s" % (ts, i % 1000, ext), make_jpeg(padding=padding)
+    if kind == "exif" and ext == "tif":
+        return "SCAN_%07d.%s" % (i, ext), make_tiff(exif_dt, padding)
+    if kind == "exif":
+        return "DSC_%07d.%s" % (i, ext), make_jpeg(exif_dt, padding)
+    if kind == "png_text":
+        return "image_%07d.%s" % (i, ext), make_png(text=time.strftime("%Y-%m-%dT%H:%M:%S", t),
+                                                    padding=padding)
+    if kind == "png_exif":
+        return "image_%07d.%s" % (i, ext), make_png(dt=exif_dt, padding=padding)
+    if kind == "mvhd":
+        return "VID_%07d.%s" % (i, ext), make_mp4(ts, padding)
+
+    return "photo_%07d.%s" % (i, ext), make_jpeg(padding=padding)
+
+
+def layout_dirs(root, layout, num_files, per_dir):
+    """
+    Return directories of a layout: wide (one level of many directories),
+    deep (nested year/month/day/event directories) or flat (one directory)
+    """
+    num_dirs = max(1, num_files // per_dir)
+
+    if layout == "flat":
+        return [root]
+
+    if layout == "wide":
+        return [os.path.join(root, "album-%05d" % d) for d in range(num_dirs)]
+
+    return [os.path.join(root, "%04d" % (2000 + d % 20), "%02d" % (1 + d // 20 % 12),
+                         "%02d" % (1 + d // 240 % 28), "event-%05d" % d) for d in range(num_dirs)]
+
+
+def generate(root, num_files, layout="wide", per_dir=200, padding=0, seed=1234) -> dict:
+    """
+    Generate a synthetic archive. Returns the number of files per kind.
+    """
+    rnd = random.Random(seed)
+    dirs = layout_dirs(root, layout, num_files, per_dir)
+    kinds = [(kind, ext) for kind, ext, weight in SAMPLE_KINDS for _ in range(weight)]
+    counts = {}
+
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+    mtime = 1577836800
+
+    for i in range(num_files):
+        kind, ext = rnd.choice(kinds)
+        ts = 946684800 + rnd.randrange(20 * 365 * 86400)
+
+        name, data = make_sample(kind, ext, ts, i, padding)
+        path = os.path.join(dirs[i * len(dirs) // num_files], name)
+
+        if os.path.exists(path):
+            continue
+
+        with open(path, "wb") as f:
+            f.write(data)
+
+        # files without metadata are stamped by their mtime
+        os.utime(path, (mtime + i, mtime + i))
+
+        counts[kind] = counts.get(kind, 0) + 1
+
+    return counts
+
+
+def run_sorter(root, apply, opts) -> dict:
+    """
+    Run a sorter on an archive and return wall time and per-stage metrics
+    """
+    PixMetrics.enabled = True
+    PixMetrics.registry.clear()
+    PixMetrics.current.__dict__.clear()
+
+    sorter = PixSorter()
+    sorter.set_options(recursive=True, apply=apply, **opts)
+
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(root))
+
+    started = time.perf_counter()
+
+    try:
+        with redirect_stdout(io.StringIO()):
+            sorter.run(root)
+    finally:
+        os.chdir(cwd)
+
+    elapsed = time.perf_counter() - started
+
+    stages = PixMetrics.collect().asdict()
+    renaming = max((x.elapsed for x in sorter.workers.stats), default=0.0)
+
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "renaming_s": round(renaming, 3),
+        "files_per_s": round(sum(x.files for x in sorter.workers.stats) / elapsed, 1) if elapsed else 0.0,
+        "renamed": sum(x.renamed for x in sorter.workers.stats),
+        "stages": {k: stages[k] for k in PHASES if k in stages},
+    }
+
+
+def version_label() -> str:
+    """
+    Return a label of the current version (git describe, if available)
+    """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def show(result):
+    """
+    Print a result
+    """
+    for mode, run in result["runs"].items():
+        print("%-8s %8.3fs total, %8.3fs renaming, %10.1f files/s, %d renamed" % (
+            mode, run["elapsed_s"], run["renaming_s"], run["files_per_s"], run["renamed"]))
+
+        for name, stage in run["stages"].items():
+            print("  %-8s %9d events %10.1f ms total %9.4f ms mean %9.4f ms p99 %12s bytes" % (
+                name, stage["count"], stage["total_ms"], stage["mean_ms"], stage["p99_ms"],
+                stage["bytes"] if stage["bytes"] is not None else "-"))
+
+
+def compare(old_path, new_path):
+    """
+    Print phase times of two stored results side by side
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{old['version']} -> {new['version']}")
+
+    for mode in new["runs"]:
+        if mode not in old["runs"]:
+            continue
+
+        a, b = old["runs"][mode], new["runs"][mode]
+        rows = [("total", a["elapsed_s"] * 1e3, b["elapsed_s"] * 1e3)]
+        rows += [(k, a["stages"].get(k, {}).get("total_ms", 0.0), v["total_ms"]) for k, v in b["stages"].items()]
+
+        print(mode)
+
+        for name, x, y in rows:
+            ratio = "%7.2fx" % (x / y) if x and y else "      -"
+            print("  %-8s %12.1f ms %12.1f ms %s" % (name, x, y, ratio))
+
+
+# ===========================================================
+#  MAIN FUNCTION
+# ===========================================================
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="python3 bench/bench_archive.py")
+    parser.add_argument('-n', '--files', default=10000, type=int, dest="num_files",
+                        help="number of sample files")
+    parser.add_argument('-l', '--layout', default="wide", choices=("wide", "deep", "flat"),
+                        dest="layout", help="directory layout of the archive")
+    parser.add_argument('-p', '--per-dir', default=200, type=int, dest="per_dir",
+                        help="number of files per directory")
+    parser.add_argument('--padding', default=0, type=int, dest="padding",
+                        help="bytes of image data per file")
+    parser.add_argument('-m', '--mode', default="both", choices=("preview", "apply", "both"),
+                        dest="mode", help="run mode")
+    parser.add_argument('-w', '--workers', default=1, type=int, dest="num_workers",
+                        help="number of renaming workers")
+    parser.add_argument('--inspect-workers', default=1, type=int, dest="inspect_workers",
+                        help="number of inspection processes")
+    parser.add_argument('-s', '--scan-workers', default=1, type=int, dest="scan_workers",
+                        help="number of scanning threads")
+    parser.add_argument('--rule-stats', default=False, action="store_true", dest="rule_stats",
+                        help="count hit rates of inspection rules (per directory and prefix)")
+    parser.add_argument('--tmp', default="/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                        dest="tmp", help="directory to generate archives in (tmpfs)")
+    parser.add_argument('-o', '--out', default=None, dest="out",
+                        help="result file (default: bench/results/<version>-<time>.json)")
+    parser.add_argument('--compare', nargs=2, default=None, metavar=("OLD", "NEW"),
+                        dest="compare", help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger(ENV).setLevel(logging.WARNING)
+
+    opts = {
+        "num_workers": args.num_workers,
+        "inspect_workers": args.inspect_workers,
+        "scan_workers": args.scan_workers,
+        "rule_stats": args.rule_stats,
+    }
+
+    config = dict(vars(args), compare=None)
+    result = {"version": version_label(), "created": time.time(), "config": config, "runs": {}}
+
+    modes = ("preview", "apply") if args.mode == "both" else (args.mode,)
+    work_dir = tempfile.mkdtemp(prefix="pixbench-", dir=args.tmp)
+
+    try:
+        for mode in modes:
+            root = os.path.join(work_dir, mode, "archive")
+
+            started = time.perf_counter()
+            counts = generate(root, args.num_files, args.layout, args.per_dir, args.padding)
+            result["generated"] = counts
+
+            print(f"Generated {sum(counts.values())} files ({args.layout}) in "
+                  f"{time.perf_counter() - started:.1f}s at {root}")
+
+            result["runs"][mode] = run_sorter(root, mode == "apply", opts)
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    show(result)
+
+    out = args.out or os.path.join(RESULTS_DIR, "%s-%s.json" % (
+        result["version"], time.strftime("%Y%m%d-%H%M%S")))
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+
+    with open(out, "w") as f:
+        json.dump(result, f, indent=1)
+
+    print(f"Result is written to {out}")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of rule2: EXIF DateTimeOriginal extraction. Copies JPEG and
+TIFF samples of resources/in to tmpfs (/dev/shm if present) until a given
+number of files, and compares the IFD walker over a mmap with exifread.
+Checks that both give the same timestamps (to the second).
+
+    python3 bench/bench_exif.py [-n NUM_FILES]
+"""
+import os
+import sys
+import shutil
+import timeit
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.pixfile import PixFile                                     # noqa: E402
+from app.pixtype import PX_TYPE                                     # noqa: E402
+from app.pixmeta import PixExifReader                               # noqa: E402
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "resources", "in")
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def make_corpus(work_dir, n) -> list:
+    """
+    Copy JPEG and TIFF samples into a directory, round robin, until n files
+    """
+    samples = []
+
+    for root, _, files in os.walk(RESOURCES_DIR):
+        for x in sorted(files):
+            with PixFile(os.path.join(root, x)) as px:
+                if px.type in (PX_TYPE.JPG, PX_TYPE.TIF):
+                    samples.append(px.path)
+
+    paths = []
+
+    for i in range(n):
+        src = samples[i % len(samples)]
+        dst = os.path.join(work_dir, "%07d-%s" % (i, os.path.basename(src)))
+        shutil.copyfile(src, dst)
+        paths.append(dst)
+
+    return paths
+
+
+def read_native(paths) -> list:
+    """
+    Read DateTimeOriginal by walking IFDs over a mmap
+    """
+    results = []
+
+    for x in paths:
+        with PixFile(x) as px:
+            results.append(PixExifReader.datetime_original(px.mmap(), px.file))
+
+    return results
+
+
+def read_exifread(paths) -> list:
+    """
+    Read DateTimeOriginal by exifread
+    """
+    results = []
+
+    for x in paths:
+        with PixFile(x) as px:
+            results.append(PixExifReader.datetime_original_exifread(px.rewind()))
+
+    return results
+
+
+# ===========================================================
+#  MAIN FUNCTION
+# ===========================================================
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="python3 bench/bench_exif.py")
+    parser.add_argument('-n', '--files', default=10000, type=int, dest="num_files",
+                        help="number of sample files")
+    parser.add_argument('--tmp', default="/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                        dest="tmp", help="directory to copy samples in (tmpfs)")
+    args = parser.parse_args()
+
+    # samples without EXIF are expected, so do not log them
+    logging.disable(logging.CRITICAL)
+
+    work_dir = tempfile.mkdtemp(prefix="pixbench-", dir=args.tmp)
+
+    try:
+        paths = make_corpus(work_dir, args.num_files)
+
+        # check results first: exifread has no sub-seconds
+        native = [x.replace(microsecond=0) if x else None for x in read_native(paths)]
+        assert native == read_exifread(paths)
+
+        print(f"{len(paths)} files, {sum(x is not None for x in native)} with DateTimeOriginal, "
+              f"results identical")
+
+        cases = (
+            ("exifread", lambda: read_exifread(paths)),
+            ("IFD walker (mmap)", lambda: read_native(paths)),
+        )
+
+        for title, func in cases:
+            secs = min(timeit.repeat(func, number=1, repeat=3))
+            print("%-20s %8.3fs %10.0f files/s" % (title, secs, len(paths) / secs))
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
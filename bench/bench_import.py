@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark. Runs startup paths in fresh interpreters with
+"-X importtime", and reports their import time and the slowest modules.
+Heavy modules (media libraries, yaml, numpy, asyncio, multiprocessing) must
+not be imported on startup paths: it fails if one is, or if import time
+exceeds a given budget. Paths are run in an empty directory, so logging is
+not configured by resources/logging.conf.
+
+    python3 bench/bench_import.py [-r REPEAT] [-t TOP] [--budget MSECS]
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_PATH = os.path.join(REPO_DIR, "main.py")
+
+# modules which are imported on first use only
+HEAVY_MODULES = ("PIL", "exifread", "numpy", "yaml", "asyncio", "multiprocessing")
+
+# startup paths: (name, interpreter arguments), run in an empty directory
+SCENARIOS = (
+    ("main.py --help", [MAIN_PATH, "--help"]),
+    ("import app.pixsort", ["-c", "import app.pixsort"]),
+    ("main.py -i (empty dir)", [MAIN_PATH, "-i", "."]),
+)
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def importtime(args, work_dir) -> dict:
+    """
+    Run python with -X importtime, and return cumulative import time (us)
+    of each module. Nested modules are indented by their depth.
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=work_dir, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = {}
+
+    # lines: "import time: self [us] | cumulative | imported package"
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name[1:].rstrip()] = int(cumulative)
+
+    return modules
+
+
+def total_us(modules) -> int:
+    """
+    Return total import time: the sum over top-level imports
+    """
+    return sum(us for name, us in modules.items() if not name.startswith(" "))
+
+
+def heavy(modules) -> list:
+    """
+    Return heavy modules imported
+    """
+    names = {name.strip().split(".")[0] for name in modules}
+
+    return [x for x in HEAVY_MODULES if x in names]
+
+
+# ===========================================================
+#  MAIN FUNCTION
+# ===========================================================
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="python3 bench/bench_import.py")
+    parser.add_argument('-r', '--repeat', default=5, type=int, dest="repeat",
+                        help="number of runs per startup path (the fastest one is taken)")
+    parser.add_argument('-t', '--top', default=10, type=int, dest="top",
+                        help="number of slowest top-level modules to show")
+    parser.add_argument('--budget', default=None, type=float, dest="budget",
+                        help="maximum import time in milliseconds")
+    args = parser.parse_args()
+
+    failed = False
+    work_dir = tempfile.mkdtemp(prefix="pixbench-")
+
+    for name, argv in SCENARIOS:
+        runs = [importtime(argv, work_dir) for _ in range(max(1, args.repeat))]
+        modules = min(runs, key=total_us)
+        total = total_us(modules) / 1e3
+
+        print(f"{name}: {total:.1f} ms, {len(modules)} modules")
+
+        top = sorted((x for x in modules.items() if not x[0].startswith(" ")), key=lambda x: -x[1])
+
+        for module, us in top[:args.top]:
+            print("  %8.1f ms %s" % (us / 1e3, module))
+
+        loaded = heavy(modules)
+
+        if loaded:
+            print(f"  FAIL: heavy module(s) imported: {', '.join(loaded)}")
+            failed = True
+
+        if args.budget is not None and args.budget < total:
+            print(f"  FAIL: over budget ({args.budget:.1f} ms)")
+            failed = True
+
+    os.rmdir(work_dir)
+
+    sys.exit(1 if failed else 0)
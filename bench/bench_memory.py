@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark of the renaming work plan. Measures bytes per file kept by
+PixWorkerGroup after adding works, compared with the previous layout (a
+PixStampGroup with a path list per stamp, a key string index and deques).
+
+    python3 bench/bench_memory.py [-n NUM_FILES] [-d NUM_DIRS]
+"""
+import os
+import sys
+import random
+import argparse
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.pixstamp import PixStamp                                   # noqa: E402
+from app.pixwork import PixWorkerGroup                              # noqa: E402
+
+
+# ===========================================================
+# CLASS IMPLEMENTATIONS
+# ===========================================================
+class LegacyStampGroup:
+    """
+    Pix stamp group (previous layout)
+    """
+    def __init__(self, fmt, stamp):
+        self.fmt = fmt
+        self.stamp = stamp
+        self.paths = []
+
+    def key(self):
+        return f"{self.fmt}/{self.stamp}"
+
+
+class LegacyWorkerGroup:
+    """
+    Renaming work store (previous layout)
+    """
+    def __init__(self, num_workers):
+        self.index = {}
+        self.workq = [deque() for _ in range(num_workers)]
+        self.count = 0
+
+    def add_work(self, pixstamp, path):
+        key = f"{pixstamp.fmt}/{pixstamp.stamp}"
+
+        if key not in self.index:
+            psg = LegacyStampGroup(pixstamp.fmt, pixstamp.stamp)
+            self.workq[self.count % len(self.workq)].append(psg)
+            self.index[psg.key()] = psg
+            self.count += 1
+
+        self.index[key].paths.append(path)
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def make_works(num_files, num_dirs):
+    """
+    Make (stamp fields, directory, base name) of sample files. About one in
+    ten files shares its stamp with another file.
+    """
+    rnd = random.Random(1234)
+    works = []
+
+    for i in range(num_files):
+        if works and rnd.random() < 0.1:
+            # burst shot: same stamp in the same directory
+            ts, dir_path, _ = works[-1]
+            works.append((ts, dir_path, "IMG_%04d%02d%02d_%02d%02d%02d_%03d(%d).jpg" % (ts + (i,))))
+            continue
+
+        d = rnd.randrange(num_dirs)
+        ts = (2000 + d % 20, 1 + d % 12, 1 + i % 28, i % 24, i % 60, rnd.randrange(60), i % 1000)
+
+        dir_path = "/volume1/archive/photos/%04d/%02d/album-%05d" % (ts[0], ts[1], d)
+        works.append((ts, dir_path, "IMG_%04d%02d%02d_%02d%02d%02d_%03d.jpg" % ts))
+
+    return works
+
+
+def measure(factory, works):
+    """
+    Return bytes held by a work store after adding all works. Path strings
+    and pixstamps are created while measuring, as the scanner and inspector
+    would do.
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    store = factory()
+
+    for ts, dir_path, name in works:
+        stamp = PixStamp("jpg", "img_%04d%02d%02d_%02d%02d%02d_%03d" % ts, "R1")
+        store.add_work(stamp, os.path.join(dir_path, name))
+
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return after - before, store
+
+
+# ===========================================================
+#  MAIN FUNCTION
+# ===========================================================
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="python3 bench/bench_memory.py")
+    parser.add_argument('-n', '--files', default=200000, type=int, dest="num_files",
+                        help="number of sample files")
+    parser.add_argument('-d', '--dirs', default=1000, type=int, dest="num_dirs",
+                        help="number of sample directories")
+    args = parser.parse_args()
+
+    works = make_works(args.num_files, args.num_dirs)
+
+    legacy, legacy_store = measure(lambda: LegacyWorkerGroup(4), works)
+    legacy_groups = len(legacy_store.index)
+    del legacy_store
+
+    current, store = measure(lambda: PixWorkerGroup(4), works)
+
+    assert legacy_groups == len(store.plan)
+
+    print(f"{args.num_files} files, {legacy_groups} groups, {args.num_dirs} directories")
+    print("%-8s %12d bytes %8.1f bytes/file" % ("before", legacy, legacy / args.num_files))
+    print("%-8s %12d bytes %8.1f bytes/file" % ("after", current, current / args.num_files))
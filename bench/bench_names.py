@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of rule1: file name matching and stamp construction.
+Compares the integer-based datetime path with strptime, and one by one
+stamp construction with the bulk one (PixStamp.new_many). Checks that all
+of them give identical results.
+
+    python3 bench/bench_names.py [-n NUM_NAMES]
+"""
+import os
+import sys
+import random
+import timeit
+import logging
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.pixtype import PX_TYPE                                     # noqa: E402
+from app.pixsort import NAME_PATTERNS                               # noqa: E402
+from app.pixstamp import STAMP_STYLE, TSINFO_TYPE, PixStamp         # noqa: E402
+
+
+# ===========================================================
+# SYMBOLIC CONSTANTS
+# ===========================================================
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "resources", "in")
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def match_name(pix_name):
+    """
+    Sequential pattern matching (as rule1)
+    """
+    for p, tsi_type in NAME_PATTERNS:
+        is_matched = p.match(pix_name)
+        if is_matched:
+            return tsi_type, is_matched.groups()
+
+    return None
+
+
+def legacy_new(style, tsi_type, tsi_data, pix_type):
+    """
+    strptime based stamp construction (reference implementation)
+    """
+    if TSINFO_TYPE.STANDARD != tsi_type:
+        return PixStamp.new(style, tsi_type, tsi_data, pix_type)
+
+    date_s, time_s, usec_s = tsi_data
+    usec_s = (usec_s + "000")[:3]
+
+    try:
+        dt = datetime.strptime(f"{date_s}_{time_s}.{usec_s}", "%Y%m%d_%H%M%S.%f")
+    except ValueError:
+        return None
+
+    return PixStamp(pix_type.fmt, "%s_%s" % (pix_type.cls, dt.strftime(style)[:-3]))
+
+
+def make_corpus(n):
+    """
+    Make sample names: names in resources and random names of every pattern,
+    including invalid dates and names matching no pattern
+    """
+    rnd = random.Random(1234)
+    names = []
+
+    for _, _, files in os.walk(RESOURCES_DIR):
+        names.extend(files)
+
+    def ts():
+        return (rnd.randint(1990, 2030), rnd.randint(1, 13), rnd.randint(1, 31),
+                rnd.randint(0, 24), rnd.randint(0, 59), rnd.randint(0, 61))
+
+    while len(names) < n:
+        y, m, d, H, M, S = ts()
+        kind = rnd.randint(0, 6)
+
+        if kind == 0:
+            names.append("IMG_%04d%02d%02d_%02d%02d%02d_%06d.jpg" % (y, m, d, H, M, S, rnd.randint(0, 999999)))
+        elif kind == 1:
+            names.append("%04d%02d%02d_%02d%02d%02d.jpg" % (y, m, d, H, M, S))
+        elif kind == 2:
+            names.append("KakaoTalk_%04d%02d%02d_%02d%02d%02d%03d_%02d.jpg" % (y, m, d, H, M, S, rnd.randint(0, 999), rnd.randint(0, 99)))
+        elif kind == 3:
+            names.append("Screenshot_%04d%02d%02d-%02d%02d%02d_App.png" % (y, m, d, H, M, S))
+        elif kind == 4:
+            names.append("screenshot_%04d-%02d-%02d AM %d.%02d.%02d.png" % (y, m, d, H, M, S))
+        elif kind == 5:
+            names.append("%d.jpg" % rnd.randint(10 ** 12, 10 ** 13))
+        else:
+            names.append("Photo_%03d.jpg" % rnd.randint(0, 999))
+
+    return names
+
+
+def run_bulk(match, names, style):
+    """
+    Match all names and create stamps in bulk per timestamp information type
+    """
+    stamps = [None] * len(names)
+    rows = {}
+
+    for i, x in enumerate(names):
+        is_matched = match(x)
+        if is_matched:
+            tsi_type, tsi_data = is_matched
+            rows.setdefault(tsi_type, []).append((i, tsi_data))
+
+    for tsi_type, tsi_rows in rows.items():
+        indexes, tsi_datas = zip(*tsi_rows)
+        pix_types = [PX_TYPE.JPG] * len(indexes)
+
+        for i, stamp in zip(indexes, PixStamp.new_many(
+                style, tsi_type, tuple(zip(*tsi_datas)), pix_types, [""] * len(indexes))):
+            stamps[i] = stamp
+
+    return stamps
+
+
+def run_all(match, new, names, style):
+    """
+    Match all names and create stamps
+    """
+    stamps = []
+
+    for x in names:
+        is_matched = match(x)
+        if is_matched:
+            tsi_type, tsi_data = is_matched
+            stamps.append(new(style, tsi_type, tsi_data, PX_TYPE.JPG))
+        else:
+            stamps.append(None)
+
+    return stamps
+
+
+# ===========================================================
+#  MAIN FUNCTION
+# ===========================================================
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="python3 bench/bench_names.py")
+    parser.add_argument('-n', '--names', default=100000, type=int, dest="num_names",
+                        help="number of sample names")
+    args = parser.parse_args()
+
+    # invalid names are expected, so do not log them
+    logging.disable(logging.CRITICAL)
+
+    style = STAMP_STYLE.STANDARD.fmt
+    names = make_corpus(args.num_names)
+
+    def new_stamp(style, tsi_type, tsi_data, pix_type):
+        return PixStamp.new(style, tsi_type, tsi_data, pix_type)
+
+    # check results first
+    legacy = [str(s) for s in run_all(match_name, legacy_new, names, style)]
+    current = [str(s) for s in run_all(match_name, new_stamp, names, style)]
+    assert legacy == current
+
+    bulk = [str(s) for s in run_bulk(match_name, names, style)]
+    assert legacy == bulk
+
+    print(f"{len(names)} names, {sum(s != 'None' for s in current)} stamped, results identical")
+
+    cases = (
+        ("match", lambda: [match_name(x) for x in names]),
+        ("match+stamp (before)", lambda: run_all(match_name, legacy_new, names, style)),
+        ("match+stamp (after)", lambda: run_all(match_name, new_stamp, names, style)),
+        ("match+stamp (bulk)", lambda: run_bulk(match_name, names, style)),
+    )
+
+    for title, func in cases:
+        secs = min(timeit.repeat(func, number=1, repeat=5))
+        print("%-22s %8.3fs %10.0f names/s" % (title, secs, len(names) / secs))
@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import sys
-import yaml
 import argparse
 import os.path
-import logging.config
+import logging
 
 from app.common import ENV
-from app.pixsort import PixSorter
 
 
 # ===========================================================
@@ -31,19 +29,98 @@ if __name__ == "__main__":
     # Parse command-line
     parser = argparse.ArgumentParser(prog="python3 main.py", description=HELP)
 
-    parser.add_argument('-i', '--in', metavar="IN_DIR", required=True,
+    target = parser.add_mutually_exclusive_group(required=True)
+
+    target.add_argument('-i', '--in', metavar="IN_DIR",
                         dest="in_dir",
                         help="directory path which contains pix files.")
 
+    target.add_argument('--apply-plan', metavar="PLAN",
+                        dest="apply_plan",
+                        help="apply a renaming plan saved by --save-plan, skipping changed files")
+
+    target.add_argument('--undo', metavar="JOURNAL",
+                        dest="undo",
+                        help="undo renames recorded in a journal (journal-*.jsonl)")
+
+    target.add_argument('--redo', metavar="JOURNAL",
+                        dest="redo",
+                        help="redo renames recorded in a journal (journal-*.jsonl)")
+
     parser.add_argument('-r', '--recursive', required=False, default=False,
                         dest="recursive", action="store_true",
                         help="recursively traverse sub-directories")
 
+    parser.add_argument('--hidden', required=False, default=False,
+                        dest="hidden", action="store_true",
+                        help="include hidden files and directories (dot files)")
+
     parser.add_argument('-u', '--uppercase', required=False, default=False,
                         dest="uppercase", action="store_true", help="rename to uppercase name")
 
     parser.add_argument('-w', '--workers', required=False, default=1, type=int,
-                        dest="num_workers", help="number of renaming workers")
+                        dest="num_workers", help="number of renaming workers (0: sized by CPU count)")
+
+    parser.add_argument('--backend', required=False, default="thread",
+                        dest="backend", choices=("thread", "async"),
+                        help="renaming backend: worker threads, or an asyncio event loop "
+                        "for high-latency network file systems")
+
+    parser.add_argument('--concurrency', required=False, default=64, type=int,
+                        dest="concurrency",
+                        help="maximum number of renames in flight (with --backend async)")
+
+    parser.add_argument('-s', '--scan-workers', required=False, default=1, type=int,
+                        dest="scan_workers", help="number of directory scanning threads")
+
+    parser.add_argument('--scan-unordered', required=False, default=False,
+                        dest="scan_unordered", action="store_true",
+                        help="take directory listings as they complete (with --scan-workers)")
+
+    parser.add_argument('--inspect-workers', required=False, default=1, type=int,
+                        dest="inspect_workers", help="number of file inspection processes")
+
+    parser.add_argument('--cache', required=False, default=None, nargs="?", const=True,
+                        dest="cache", metavar="CACHE_FILE",
+                        help="reuse inspection results of unchanged files "
+                        "(default cache file: IN_DIR/.pixcache.db)")
+
+    parser.add_argument('--incremental', required=False, default=None, nargs="?", const=True,
+                        dest="incremental", metavar="MANIFEST_FILE",
+                        help="skip directories unchanged and files stamped since the last applied run "
+                        "(default manifest file: IN_DIR/.pixmanifest.jsonl)")
+
+    parser.add_argument('--rule-stats', required=False, default=False,
+                        dest="rule_stats", action="store_true",
+                        help="report hit rates of inspection rules per directory "
+                        "(and file name prefix)")
+
+    parser.add_argument('--stream', required=False, default=False,
+                        dest="stream", action="store_true",
+                        help="rename directory by directory while scanning "
+                        "(sequence numbers are per directory)")
+
+    parser.add_argument('--save-plan', required=False, default=None,
+                        dest="save_plan", metavar="PLAN",
+                        help="save the renaming plan of a preview, to apply it later by --apply-plan")
+
+    parser.add_argument('--bash-history', required=False, default=False,
+                        dest="bash_history", action="store_true",
+                        help="also write renames as a bash script (history-*.sh)")
+
+    parser.add_argument('--trace', required=False, default=0.0, nargs="?", const=1.0, type=float,
+                        dest="trace", metavar="RATE",
+                        help="log per-file lines for a sampled fraction of files (default: all)")
+
+    parser.add_argument('--report', required=False, default=None, nargs="?", const="report.json",
+                        dest="report", metavar="REPORT_FILE",
+                        help="write per-stage counts, latencies and bytes read as JSON "
+                        "(default: report.json)")
+
+    parser.add_argument('--profile', required=False, default=False,
+                        dest="profile", action="store_true",
+                        help="profile the run by cProfile (main thread) and tracemalloc, "
+                        "and add results to the report")
 
     parser.add_argument('-a', '--apply', required=False, default=False,
                         dest="apply", action="store_true",
@@ -51,8 +128,20 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if args.save_plan and (args.apply or not args.in_dir):
+        parser.error("--save-plan saves the plan of a preview: "
+                     "it cannot be combined with -a/--apply, --apply-plan, --undo or --redo")
+
+    # heavy modules are imported after parsing, so that --help and usage
+    # errors return at once (media libraries are imported on first use)
+    from app.pixsort import PixSorter
+    from app.pixlog import PixTrace, setup_logging, stop_logging
+    from app.pixmetrics import PixReport
+
     # Set logger
     if os.path.exists("resources/logging.conf"):
+        import yaml
+
         with open("resources/logging.conf", "r") as f:
             config = yaml.load(f, Loader=yaml.FullLoader)
 
@@ -62,10 +151,13 @@ if __name__ == "__main__":
             if not os.path.exists(log_dir):
                 os.mkdir(log_dir)
 
-            logging.config.dictConfig(config)
+            setup_logging(config)
     else:
         logging.basicConfig(level=logging.INFO)
 
+    if args.trace:
+        PixTrace.enable(args.trace)
+
     logger = logging.getLogger(ENV)
     logger.info(args)
     logger.info("<< Start Pixsort >>")
@@ -73,10 +165,38 @@ if __name__ == "__main__":
     # Run pixsort job
     sorter = PixSorter()
     sorter.set_options(recursive=args.recursive,
+                       hidden=args.hidden,
                        uppercase=args.uppercase,
                        num_workers=args.num_workers,
+                       backend=args.backend,
+                       concurrency=args.concurrency,
+                       scan_workers=args.scan_workers,
+                       scan_ordered=not args.scan_unordered,
+                       inspect_workers=args.inspect_workers,
+                       cache=args.cache,
+                       incremental=args.incremental,
+                       rule_stats=args.rule_stats,
+                       stream=args.stream,
+                       bash_history=args.bash_history,
+                       save_plan=args.save_plan,
                        apply=args.apply)
 
-    sorter.run(args.in_dir)
+    # Enable instrumentation
+    report = None
+
+    if args.report or args.profile:
+        report = PixReport(args.report or "report.json", profile=args.profile)
+
+    if args.in_dir:
+        sorter.run(args.in_dir)
+    elif args.apply_plan:
+        sorter.apply_plan(args.apply_plan)
+    else:
+        sorter.replay(args.undo or args.redo, undo=bool(args.undo))
+
+    if report:
+        report.close()
+
+    stop_logging()
 
     sys.exit(0)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from app.pixcache import PixCache
+from app.pixstamp import PixStamp
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def make_file(path, data=b"pix") -> os.stat_result:
+    """
+    Create a file and return its stat
+    """
+    path.write_bytes(data)
+    return os.stat(path)
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache.db")
+
+
+def cached(cache_path, path) -> tuple:
+    """
+    Look up a file in a new run of the cache, and return its stamp as a tuple
+    """
+    cache = PixCache(cache_path)
+
+    try:
+        stamp = cache.get(str(path), os.stat(path))
+        return stamp.astuple() if stamp is not None else None
+    finally:
+        cache.close()
+
+
+def store(cache_path, path, stamp):
+    """
+    Store a stamp of a file in a new run of the cache
+    """
+    cache = PixCache(cache_path)
+    cache.put(str(path), os.stat(path), stamp)
+    cache.close()
+
+
+# ===========================================================
+# TESTS
+# ===========================================================
+STAMP = PixStamp("jpg", "img_20200101_120000_000", "R2")
+
+
+def test_hit(tmp_path, cache_path):
+    path = tmp_path / "a.jpg"
+    make_file(path)
+    store(cache_path, path, STAMP)
+
+    assert cached(cache_path, path) == STAMP.astuple()
+
+
+def test_miss(tmp_path, cache_path):
+    path = tmp_path / "a.jpg"
+    make_file(path)
+
+    assert cached(cache_path, path) is None
+
+
+def test_size_changed(tmp_path, cache_path):
+    path = tmp_path / "a.jpg"
+    st = make_file(path)
+    store(cache_path, path, STAMP)
+
+    # same mtime, other size
+    with open(path, "ab") as f:
+        f.write(b"more")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    assert cached(cache_path, path) is None
+
+
+def test_mtime_changed(tmp_path, cache_path):
+    path = tmp_path / "a.jpg"
+    st = make_file(path)
+    store(cache_path, path, STAMP)
+
+    # same size, other mtime
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    assert cached(cache_path, path) is None
+
+
+def test_renamed(tmp_path, cache_path):
+    path = tmp_path / "a.jpg"
+    make_file(path)
+    store(cache_path, path, STAMP)
+
+    # the same inode at a new path
+    renamed = tmp_path / "b.jpg"
+    os.rename(path, renamed)
+
+    assert cached(cache_path, renamed) == STAMP.astuple()
+
+    # and the entry follows the new path, so it is not evicted
+    cache = PixCache(cache_path)
+    cache.evict()
+    cache.close()
+
+    assert cache.evicted == 0
+    assert cached(cache_path, renamed) == STAMP.astuple()
+
+
+def test_renamed_name_rule(tmp_path, cache_path):
+    path = tmp_path / "20200101_120000.jpg"
+    make_file(path)
+    store(cache_path, path, PixStamp("jpg", "img_20200101_120000_000", "R1"))
+
+    # stamps taken from file names are only valid under the same name
+    renamed = tmp_path / "b.jpg"
+    os.rename(path, renamed)
+
+    assert cached(cache_path, renamed) is None
+
+
+def test_evict_vanished(tmp_path, cache_path):
+    path = tmp_path / "a.jpg"
+    make_file(path)
+    store(cache_path, path, STAMP)
+
+    os.remove(path)
+
+    cache = PixCache(cache_path)
+    cache.evict()
+    cache.close()
+
+    assert cache.evicted == 1
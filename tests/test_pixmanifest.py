@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import os
+
+from app.pixfinder import PixFinder
+from app.pixmanifest import PixManifest
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def make_tree(root, tree):
+    """
+    Create directories and files of a tree: directory -> file names
+    """
+    for dir_name, names in tree.items():
+        os.makedirs(os.path.join(root, dir_name), exist_ok=True)
+
+        for x in names:
+            with open(os.path.join(root, dir_name, x), "w") as f:
+                f.write(x)
+
+
+def run(root, manifest_path) -> tuple:
+    """
+    Run incrementally: find files, stamp them all in place and save the
+    manifest. Returns the files found (relative) and the manifest.
+    """
+    manifest = PixManifest(str(manifest_path), str(root))
+    files = list(PixFinder(manifest=manifest).find(str(root), recursive=True))
+
+    for x in files:
+        base, name = os.path.split(x)
+        manifest.plan(base, [(name, name)])
+
+    manifest.save()
+
+    return sorted(os.path.relpath(x, root) for x in files), manifest
+
+
+def skipped(root, manifest) -> set:
+    """
+    Return directories (relative) skipped as unchanged
+    """
+    return {os.path.relpath(x, root) for x in manifest.skipped()}
+
+
+# ===========================================================
+# TESTS
+# ===========================================================
+TREE = {
+    "a": ["a1.jpg", "a2.jpg"],
+    "b": ["b1.jpg"],
+}
+
+
+def test_full_run(tmp_path):
+    root = tmp_path / "archive"
+    make_tree(root, TREE)
+
+    files, manifest = run(root, tmp_path / "manifest.jsonl")
+
+    assert files == ["a/a1.jpg", "a/a2.jpg", "b/b1.jpg"]
+    assert skipped(root, manifest) == set()
+
+
+def test_unchanged_skipped(tmp_path):
+    root = tmp_path / "archive"
+    make_tree(root, TREE)
+    run(root, tmp_path / "manifest.jsonl")
+
+    files, manifest = run(root, tmp_path / "manifest.jsonl")
+
+    assert files == []
+    assert skipped(root, manifest) == {".", "a", "b"}
+
+
+def test_touched_rescanned(tmp_path):
+    root = tmp_path / "archive"
+    make_tree(root, TREE)
+    run(root, tmp_path / "manifest.jsonl")
+
+    # a new file changes the mtime of its directory (set apart explicitly,
+    # in case of a coarse timestamp granularity)
+    make_tree(root, {"b": ["b2.jpg"]})
+    st = os.stat(root / "b")
+    os.utime(root / "b", ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    files, manifest = run(root, tmp_path / "manifest.jsonl")
+
+    # only the new file: stamped files of the directory are skipped
+    assert files == ["b/b2.jpg"]
+    assert skipped(root, manifest) == {".", "a"}
+
+    # and the directory is up to date again
+    files, manifest = run(root, tmp_path / "manifest.jsonl")
+
+    assert files == []
+    assert skipped(root, manifest) == {".", "a", "b"}
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import mmap
+import struct
+
+import pytest
+
+from app.pixmeta import PixAtomReader, QT_EPOCH_OFFSET
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def box(kind, payload=b"") -> bytes:
+    """
+    Return a box of a given type and payload
+    """
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def movie(secs, version=0) -> bytes:
+    """
+    Return a minimal movie whose header has a given creation time
+    """
+    if version == 1:
+        mvhd = box(b"mvhd", bytes([1, 0, 0, 0]) + struct.pack(">QQ", secs, secs))
+    else:
+        mvhd = box(b"mvhd", bytes(4) + struct.pack(">II", secs, secs))
+
+    return box(b"ftyp", b"isom") + box(b"moov", mvhd)
+
+
+def read_mapped(tmp_path, data) -> int:
+    """
+    Return creation time of a movie read through mmap, as inspection does
+    """
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(data)
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        return PixAtomReader.creation_time(buf)
+
+
+# ===========================================================
+# TESTS
+# ===========================================================
+SECS = QT_EPOCH_OFFSET + 1500000000
+
+
+@pytest.mark.parametrize("version", [0, 1])
+def test_creation_time(tmp_path, version):
+    assert read_mapped(tmp_path, movie(SECS, version)) == 1500000000
+
+
+def test_creation_time_unset(tmp_path):
+    assert read_mapped(tmp_path, movie(0)) is None
+
+
+@pytest.mark.parametrize("payload", [b"", b"\x00", bytes(7), b"\x01" + bytes(10)])
+def test_creation_time_truncated(tmp_path, payload):
+    # a movie header cut off at the end of the file
+    data = box(b"ftyp", b"isom") + box(b"moov", box(b"mvhd", payload))
+
+    assert read_mapped(tmp_path, data) is None
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from app.pixmove import PixMovePlanner
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def make_files(base, names):
+    """
+    Create files whose contents are their names
+    """
+    for x in names:
+        with open(os.path.join(base, x), "w") as f:
+            f.write(x)
+
+
+def contents(base) -> dict:
+    """
+    Return file name -> contents (the original name) of a directory
+    """
+    files = {}
+
+    for x in os.listdir(base):
+        with open(os.path.join(base, x)) as f:
+            files[x] = f.read()
+
+    return files
+
+
+def run(base, moves) -> list:
+    """
+    Plan and execute renames, and return the sequences as journaled
+    """
+    sequences, blocked = PixMovePlanner.plan(str(base), moves)
+    assert not blocked
+
+    journaled = [PixMovePlanner.fingerprint(str(base), x) for x in sequences]
+
+    for x in sequences:
+        assert PixMovePlanner.execute(str(base), x) == len(x)
+
+    return journaled
+
+
+def undo(sequences) -> list:
+    """
+    Return sequences to undo journaled ones
+    """
+    return [[(y, x, ino) for x, y, ino in reversed(s)] for s in reversed(sequences)]
+
+
+def replay(base, sequences) -> int:
+    """
+    Replay sequences, and return the number of renamed files
+    """
+    return sum(PixMovePlanner.replay(str(base), x) for x in sequences)
+
+
+# ===========================================================
+# TESTS
+# ===========================================================
+CASES = {
+    "chain": (["a", "b", "c"], [("a", "b"), ("b", "c"), ("c", "d")]),
+    "swap": (["a", "b"], [("a", "b"), ("b", "a")]),
+    "cycle": (["a", "b", "c"], [("a", "b"), ("b", "c"), ("c", "a")]),
+}
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_execute(tmp_path, case):
+    names, moves = CASES[case]
+    make_files(tmp_path, names)
+
+    run(tmp_path, moves)
+
+    assert contents(tmp_path) == {y: x for x, y in moves}
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_plan_blocked(tmp_path, case):
+    names, moves = CASES[case]
+    make_files(tmp_path, names + ["z"])
+
+    sequences, blocked = PixMovePlanner.plan(str(tmp_path), moves + [("a", "z")])
+
+    assert ("a", "z") in blocked
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_redo_is_repeatable(tmp_path, case):
+    names, moves = CASES[case]
+    make_files(tmp_path, names)
+
+    journaled = run(tmp_path, moves)
+    renamed = contents(tmp_path)
+
+    # renames are done already
+    assert replay(tmp_path, journaled) == 0
+    assert replay(tmp_path, journaled) == 0
+    assert contents(tmp_path) == renamed
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_undo_is_repeatable(tmp_path, case):
+    names, moves = CASES[case]
+    make_files(tmp_path, names)
+
+    journaled = run(tmp_path, moves)
+
+    assert 0 < replay(tmp_path, undo(journaled))
+    assert contents(tmp_path) == {x: x for x in names}
+
+    assert replay(tmp_path, undo(journaled)) == 0
+    assert contents(tmp_path) == {x: x for x in names}
+
+    # and redone after all
+    assert 0 < replay(tmp_path, journaled)
+    assert contents(tmp_path) == {y: x for x, y in moves}
+
+
+def test_replay_partial(tmp_path):
+    make_files(tmp_path, ["a", "b", "c"])
+    sequences, _ = PixMovePlanner.plan(str(tmp_path), CASES["chain"][1])
+    journaled = [PixMovePlanner.fingerprint(str(tmp_path), x) for x in sequences]
+
+    # interrupted after the first rename of the chain
+    (sequence,) = journaled
+    PixMovePlanner.execute(str(tmp_path), [x[:2] for x in sequence[:1]])
+
+    assert replay(tmp_path, journaled) == 2
+    assert contents(tmp_path) == {"b": "a", "c": "b", "d": "c"}
+
+
+def test_replay_changed(tmp_path):
+    make_files(tmp_path, ["a", "b"])
+    journaled = run(tmp_path, CASES["swap"][1])
+
+    # a file has been replaced since (created first, so its inode is new)
+    make_files(tmp_path, ["new"])
+    os.replace(os.path.join(tmp_path, "new"), os.path.join(tmp_path, "a"))
+
+    assert replay(tmp_path, undo(journaled)) == 0
+
+
+def test_execute_case_only(tmp_path):
+    # a case-insensitive file system finds the source under the target name,
+    # as a hard link does here
+    make_files(tmp_path, ["IMG.JPG"])
+    os.link(os.path.join(tmp_path, "IMG.JPG"), os.path.join(tmp_path, "img.jpg"))
+
+    assert PixMovePlanner.execute(str(tmp_path), [("IMG.JPG", "img.jpg")]) == 1
+
+
+def test_execute_case_only_taken(tmp_path):
+    # another file, differing in case only
+    make_files(tmp_path, ["IMG.JPG", "img.jpg"])
+
+    assert PixMovePlanner.execute(str(tmp_path), [("IMG.JPG", "img.jpg")]) == 0
+    assert contents(tmp_path) == {"IMG.JPG": "IMG.JPG", "img.jpg": "img.jpg"}
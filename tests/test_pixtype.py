@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import struct
+
+import pytest
+
+from app.pixfile import PixFile
+from app.pixtype import PX_TYPE
+
+
+# ===========================================================
+# FUNCTIONS
+# ===========================================================
+def movie_type(tmp_path, name, brand) -> PX_TYPE:
+    """
+    Return the type of a movie file with a given ftyp brand
+    """
+    path = tmp_path / name
+    path.write_bytes(struct.pack(">I4s4sI", 16, b"ftyp", brand, 0) + bytes(16))
+
+    with PixFile(str(path)) as px:
+        return px.type
+
+
+# ===========================================================
+# TESTS
+# ===========================================================
+@pytest.mark.parametrize("name, brand, pix_type", [
+    ("clip.mp4", b"isom", PX_TYPE.MP4),
+    ("clip.mov", b"qt  ", PX_TYPE.MOV),
+
+    # brands are shared, so the extension is kept
+    ("clip.mov", b"isom", PX_TYPE.MOV),
+    ("clip.MP4", b"qt  ", PX_TYPE.MP4),
+
+    # other brands are told by their extensions only
+    ("clip.mp4", b"3gp4", PX_TYPE.MP4),
+    ("clip.3gp", b"3gp4", PX_TYPE.UNKNOWN),
+    ("clip.m4v", b"M4V ", PX_TYPE.UNKNOWN),
+    ("clip.m4v", b"isom", PX_TYPE.UNKNOWN),
+])
+def test_movie_type(tmp_path, name, brand, pix_type):
+    assert movie_type(tmp_path, name, brand) is pix_type